@@ -0,0 +1,114 @@
+import math
+import os
+
+import faiss
+import numpy as np
+
+# Index types, selected with the RAG_INDEX_TYPE env var (read per call so
+# .env changes apply); "auto" picks by corpus size:
+#   flat      – exact search, linear per query; best below ~20k documents
+#   hnsw      – graph search, no training, ~+256 B/vector; up to ~500k
+#   ivf_flat  – k-means buckets, exact vectors, nprobe buckets searched
+#   ivf_pq    – k-means buckets + product-quantized codes (1 byte per 8 dims),
+#               candidates re-ranked on the exact vectors
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+DEFAULT_INDEX_TYPE = "auto"
+AUTO_FLAT_MAX = 20_000
+AUTO_HNSW_MAX = 500_000
+
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+# Recall knobs (RAG_EF_SEARCH / RAG_NPROBE override them)
+DEFAULT_EF_SEARCH = 64
+DEFAULT_NPROBE = 16
+# Training points per IVF bucket / PQ centroid (faiss warns below 39)
+IVF_TRAIN_PER_LIST = 64
+# Below this IVF can't be trained properly – and a flat scan is fast anyway
+IVF_MIN_VECTORS = 10_000
+PQ_BITS = 8
+# IVF-PQ re-ranks k·REFINE_K_FACTOR candidates exactly; PQ distances alone
+# lose most near-duplicate respondents (recall@5 ≈ 0.4 in bench_ann_index)
+REFINE_K_FACTOR = 16
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def index_type(n_vectors: int, requested=None) -> str:
+    """The index type to build for `n_vectors` documents."""
+    requested = (requested or os.getenv("RAG_INDEX_TYPE", DEFAULT_INDEX_TYPE)).strip().lower()
+    if requested not in INDEX_TYPES:
+        if requested != "auto":
+            print(f"⚠️ Unknown RAG index type '{requested}', choosing by corpus size")
+        requested = "flat" if n_vectors <= AUTO_FLAT_MAX else "hnsw" if n_vectors <= AUTO_HNSW_MAX else "ivf_pq"
+    if requested.startswith("ivf") and n_vectors < IVF_MIN_VECTORS:
+        return "flat"
+    return requested
+
+
+def kind_of(index) -> str:
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexRefine):
+        return kind_of(index.base_index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def _nlist(n_vectors: int) -> int:
+    """~4·√n buckets, each with enough points to train on."""
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // IVF_TRAIN_PER_LIST))
+
+
+def _pq_subquantizers(dim: int) -> int:
+    """Largest divisor of dim giving ≥ 8 dimensions per sub-quantizer (1536 → 192)."""
+    return next(m for m in range(dim // 8, 0, -1) if dim % m == 0)
+
+
+def configure_search(index, nprobe=None, ef_search=None):
+    """Apply the recall/latency knobs: nprobe for IVF, efSearch for HNSW."""
+    kind = kind_of(index)
+    params = faiss.ParameterSpace()
+    if kind == "hnsw":
+        params.set_index_parameter(index, "efSearch", ef_search or _env_int("RAG_EF_SEARCH", DEFAULT_EF_SEARCH))
+    elif kind.startswith("ivf"):
+        params.set_index_parameter(index, "nprobe", nprobe or _env_int("RAG_NPROBE", DEFAULT_NPROBE))
+    return index
+
+
+def build_index(vectors, kind=None, nprobe=None, ef_search=None):
+    """An L2 index of the given type (default: index_type()) over the float32 vectors."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+    kind = index_type(n, kind)
+
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    elif kind.startswith("ivf"):
+        nlist = _nlist(n)
+        quantizer = faiss.IndexFlatL2(dim)
+        if kind == "ivf_pq":
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, _pq_subquantizers(dim), PQ_BITS)
+        else:
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        # k-means on a sample: enough points per bucket and per PQ centroid
+        sample = max(nlist, 2 ** PQ_BITS) * IVF_TRAIN_PER_LIST
+        train = vectors[np.sort(np.random.default_rng(0).choice(n, sample, replace=False))] if n > sample else vectors
+        index.train(train)
+        if kind == "ivf_pq":
+            index = faiss.IndexRefineFlat(index)
+            index.k_factor = REFINE_K_FACTOR
+    else:
+        index = faiss.IndexFlatL2(dim)
+
+    index.add(vectors)
+    return configure_search(index, nprobe, ef_search)
@@ -0,0 +1,121 @@
+import re
+import pandas as pd
+
+BASE_QID_PATTERN = re.compile(r"^Q\d+$")
+
+
+def _cell(value) -> str:
+    return str(value).strip() if pd.notna(value) else ""
+
+
+def normalize_code(value) -> str:
+    """
+    Canonical text form of an answer code, so 1, 1.0, "1" and " 1.0 " all
+    become "1". Non-numeric codes are only stripped.
+    """
+    text = _cell(value)
+    try:
+        number = float(text)
+    except ValueError:
+        return text
+    return str(int(number)) if number.is_integer() else text
+
+
+def _typed_code(value):
+    """Convert "1.0" → 1 the way the filters expect; other codes stay strings."""
+    text = _cell(value)
+    try:
+        return int(float(text))
+    except (ValueError, OverflowError):
+        return text
+
+
+class AnswerKey:
+    """
+    Parsed "Answer key" sheet with O(1) lookups per QID.
+
+    InQuery layout:   a QID row (col A = QID, col B = question text) followed by
+                      option rows (col A = code, col B = label) until a blank row.
+    Qualtrics layout: col A = QID on the first row of each (merged) block,
+                      col B = code, col C = label.
+    """
+
+    def __init__(self, key_df: pd.DataFrame, data_format: str = "inquery"):
+        self.data_format = data_format
+        self._order = []
+        self._text = {}
+        self._options = {}
+        self._code_by_label = {}
+        self._label_by_code = {}
+
+        if data_format == "qualtrics":
+            self._parse_qualtrics(key_df)
+        else:
+            self._parse_inquery(key_df)
+
+    def _add_question(self, qid, text=None):
+        if qid not in self._text:
+            self._order.append(qid)
+            self._text[qid] = text
+            self._options[qid] = []
+            self._code_by_label[qid] = {}
+            self._label_by_code[qid] = {}
+        elif text and not self._text[qid]:
+            self._text[qid] = text
+
+    def _add_option(self, qid, code, label):
+        typed = _typed_code(code)
+        self._options[qid].append((typed, label))
+        self._code_by_label[qid].setdefault(label, typed)
+        self._label_by_code[qid].setdefault(normalize_code(code), label)
+
+    def _parse_inquery(self, key_df):
+        current = None
+        for row in key_df.itertuples(index=False):
+            code = _cell(row[0])
+            label = _cell(row[1]) if len(row) > 1 else ""
+
+            if code.startswith("Q"):
+                current = code
+                self._add_question(current, label or None)
+            elif not code:
+                current = None  # blank row closes the block
+            elif current and label:
+                self._add_option(current, row[0], label)
+
+    def _parse_qualtrics(self, key_df):
+        current = None
+        for row in key_df.itertuples(index=False):
+            qid = _cell(row[0])
+            if qid:
+                current = qid
+                self._add_question(current)
+            if current and len(row) > 2:
+                label = _cell(row[2])
+                if _cell(row[1]) and label:
+                    self._add_option(current, row[1], label)
+
+    def __contains__(self, qid):
+        return qid in self._text
+
+    def question_ids(self, base_only: bool = False) -> list:
+        """QIDs in answer-key order; base_only keeps plain 'Q<digits>' ids."""
+        if base_only:
+            return [q for q in self._order if BASE_QID_PATTERN.match(q)]
+        return list(self._order)
+
+    def question_text(self, qid, default=None):
+        return self._text.get(qid) or default
+
+    def options(self, qid) -> list:
+        """[(code, label), ...] in answer-key order. Integer-like codes are ints."""
+        return list(self._options.get(qid, []))
+
+    def labels(self, qid) -> list:
+        return [label for _, label in self._options.get(qid, [])]
+
+    def code_for(self, qid, label):
+        return self._code_by_label.get(qid, {}).get(str(label).strip())
+
+    def label_for(self, qid, code, default=None):
+        return self._label_by_code.get(qid, {}).get(normalize_code(code), default)
@@ -5,34 +5,34 @@ from openpyxl.styles import Font, PatternFill, Border, Side
 from openpyxl.formatting.rule import ColorScaleRule
 from openpyxl import load_workbook
 from dotenv import load_dotenv
-from openai import OpenAI
 
 import datetime
 import json
 import os
 import pandas as pd
 import re
-from copy import deepcopy
-
-# Import processors for question types
-from routes.single_choice import process_single_choice, get_single_choice_data, process_single_choice_qualtrics
-from routes.matrix_question import process_matrix_question, get_matrix_question_data, process_matrix_question_qualtrics
-from routes.multiple_select import process_multi_select, get_multi_select_data, process_multi_select_qualtrics
-from routes.cross_cut import process_cross_cut, get_cross_cut_data, process_cross_cut_qualtrics
-from routes.rank_based import process_ranked_question ,get_ranked_data, process_ranked_question_qualtrics
-from routes.nps_question import process_nps_question, get_nps_data, process_nps_question_qualtrics
-from routes.share_of_wallet import process_share_of_wallet, get_sow_data
-from routes.ppt_export import build_matrix_slide,build_nps_slide,build_single_choice_slide
-from routes.rag_chatbot import SurveyRAG
+
+# Question processors are dispatched through routes.batch
+from routes.ppt_export import build_matrix_slide,build_nps_slide,build_single_choice_slide,build_cross_cut_slide
+from routes.rag_chatbot import get_survey_rag
 from routes.sql_agent_utils import run_sql_agent
+from routes.batch import build_jobs, job_qids, render_questions, compute_outputs
+from dataset import list_sheets, load_answer_key, load_schema, pinned_dataset, read_answer_key_sheet
+from flat_reader import COMPANIONS, COMPANION_EXTENSIONS, companion_path, find_companion, is_flat_file, is_qualtrics_export
+from ingest import start_ingest, get_job
+from openai_embeddings import get_client
+from answer_key import AnswerKey
+from schema_catalog import common_prefix
 
-from utils import detect_nps_questions, detect_single_choice_questions,detect_multi_select_questions, apply_global_filters, detect_matrix_questions_qualtrics, detect_multi_select_questions_qualtrics,detect_nps_questions_qualtrics,detect_single_choice_questions_qualtrics, extract_answer_values
+from utils import extract_answer_values
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = get_client()
 
 print("🔑 OpenAI key loaded:", os.getenv("OPENAI_API_KEY")[:10] + "...")
 
+QUALTRICS_VARIABLE = re.compile(r"^Q\d+(_\d+)?$")
+
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.secret_key = "bleh"
@@ -50,27 +50,76 @@ def index():
         if file:
             filename = file.filename
             filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-
-            xls = pd.ExcelFile(filepath)
-            sheet_names = [s.strip() for s in xls.sheet_names]
+            # ✅ Streamed to disk in 1 MB blocks
+            file.save(filepath, buffer_size=1 << 20)
+
+            if is_flat_file(filepath):
+                # ✅ CSV/TSV/Parquet: Answer key (and Variable information) come as companion files
+                for kind in COMPANIONS:
+                    companion = request.files.get(f'{kind}_file')
+                    if not companion or not companion.filename:
+                        continue
+                    ext = os.path.splitext(companion.filename)[1].lower()
+                    if ext not in COMPANION_EXTENSIONS:
+                        return jsonify({"success": False, "error": f"Unsupported {COMPANIONS[kind]} file type: {ext}"})
+                    for old_ext in COMPANION_EXTENSIONS:
+                        if os.path.exists(companion_path(filepath, kind, old_ext)):
+                            os.remove(companion_path(filepath, kind, old_ext))
+                    companion.save(companion_path(filepath, kind, ext), buffer_size=1 << 20)
+
+                if find_companion(filepath, "answer_key") is None:
+                    return jsonify({"success": False, "error": "Please upload the Answer key file with your data file"})
+                sheet_names = list_sheets(filepath)
+                is_qualtrics = is_qualtrics_export(filepath)
+            else:
+                # ✅ Sheet names straight from the workbook manifest (no parsing)
+                sheet_names = [s.strip() for s in list_sheets(filepath)]
 
-            # Detect if Qualtrics-style file is present
-            is_qualtrics = "variable information" in [s.lower() for s in sheet_names]
+                # Detect if Qualtrics-style file is present
+                is_qualtrics = "variable information" in [s.lower() for s in sheet_names]
 
             # Exclude Answer key and Variable info from dropdown
             excluded = {"answer key", "variable information"}
             sheets = [s for s in sheet_names if s.strip().lower() not in excluded]
 
+            # ✅ Start ingesting the preselected sheet while the user picks the options
+            upload_id = None
+            if sheets:
+                job = start_ingest(app.config['UPLOAD_FOLDER'], filename, sheets[0],
+                                   "qualtrics" if is_qualtrics else "inquery")
+                upload_id = job.upload_id
+
             return jsonify({
                 "success": True,
                 "filename": filename,
                 "sheets": sheets,
-                "is_qualtrics": is_qualtrics
+                "is_qualtrics": is_qualtrics,
+                "upload_id": upload_id
             })
         return jsonify({"success": False, "error": "No file uploaded"})
     return render_template('index.html')
 
+# -----------------------------------------
+# Progress of the background ingestion started at upload
+# -----------------------------------------
+@app.route('/ingest_status/<upload_id>')
+def ingest_status(upload_id):
+    job = get_job(upload_id)
+    if job is None:
+        return jsonify({"error": "Unknown upload id"}), 404
+    return jsonify(job.status())
+
+# Re-ingest when the user picks another sheet / format than the preselected one
+@app.route('/ingest', methods=['POST'])
+def ingest():
+    filename = request.form.get('filename')
+    sheet = request.form.get('sheet')
+    if not filename or not sheet:
+        return jsonify({"error": "Missing filename or sheet"}), 400
+    job = start_ingest(app.config['UPLOAD_FOLDER'], os.path.basename(filename), sheet,
+                       request.form.get('data_format', 'inquery'))
+    return jsonify(job.status())
+
 # -----------------------------------------
 # Handles mode (single vs multi) after upload+sheet
 # -----------------------------------------
@@ -111,136 +160,13 @@ def select_columns(filename=None, sheet=None, data_format=None):
         data_format = request.form.get('data_format', 'inquery')
 
     filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    df_full = pd.read_excel(filepath, sheet_name=sheet, header=2)
-    df = df_full.iloc[1:].reset_index(drop=True) if data_format == "qualtrics" else df_full
-    df_key = pd.read_excel(filepath, sheet_name="Answer key", header=None)
-
-    # ----------------------------------------------------------------------------------
-    # Qualtrics-specific question text extraction (Variable Information sheet + fallback)
-    # ----------------------------------------------------------------------------------
-    question_map = {}
-    if data_format == "qualtrics":
-        variable_text_map = {}
-        try:
-            df_varinfo = pd.read_excel(filepath, sheet_name="Variable information", header=None)
-            from collections import defaultdict
-            grouped = defaultdict(list)
-
-            for _, row in df_varinfo.iterrows():
-                if pd.notna(row[0]) and pd.notna(row[2]):
-                    raw = str(row[0]).strip()
-                    txt = str(row[2]).strip()
-                    m = re.match(r"^(Q\d+)_\d+$", raw)
-                    if m:
-                        grouped[m.group(1)].append(txt)
-
-            def lcp(strs):
-                if not strs: return ""
-                s1, s2 = min(strs), max(strs)
-                for i, ch in enumerate(s1):
-                    if i >= len(s2) or ch != s2[i]:
-                        return s1[:i].rstrip(" :-–")
-                return s1.rstrip(" :-–")
-
-            for qid, texts in grouped.items():
-                variable_text_map[qid] = lcp(texts)
+    schema = load_schema(filepath, sheet, data_format)
 
-        except Exception as e:
-            print("Error reading Variable information:", e)
-
-        question_map.update(variable_text_map)
-
-        # Fallback to header row for missing QIDs
-        text_row = df_full.iloc[0]
-        for col in df_full.columns:
-            if not isinstance(col, str):
-                continue
-            m = re.match(r"^(Q\d+)", col)
-            if not m:
-                continue
-            qid = m.group(1)
-            if qid in question_map:
-                continue
+    # ✅ Question list (Variable information / header texts for Qualtrics,
+    # Answer key texts for InQuery) comes from the dataset's schema catalog
+    question_pairs = schema.question_pairs()
 
-            pattern = re.compile(rf"^{re.escape(qid)}(?:[_:]\d+)?$")
-            cols = [c for c in df_full.columns if pattern.match(c)]
-            texts = [str(text_row[c]).strip() for c in cols]
-
-            if len(texts) == 1:
-                question_map[qid] = texts[0]
-            else:
-                prefixes = [t.split(" - ")[0] for t in texts]
-                question_map[qid] = prefixes[0] if len(set(prefixes)) == 1 else lcp(texts)
-
-    # ----------------------------------------------------------------------------------
-    # InQuery-style question mapping (keep this from your original file)
-    # ----------------------------------------------------------------------------------
-    else:
-        data_columns = set()
-        for col in df.columns:
-            if isinstance(col, str):
-                match = re.search(r"(Q\d+)", col)
-                if match:
-                    data_columns.add(match.group(1))
-
-        i = 0
-        while i < len(df_key):
-            row = df_key.iloc[i]
-            if pd.notna(row[0]) and pd.notna(row[1]):
-                qid_match = re.match(r"(Q\d+)", str(row[0]).strip())
-                if qid_match:
-                    qid = qid_match.group(1)
-                    text = str(row[1]).strip()
-
-                    has_options = False
-                    j = i + 1
-                    while j < len(df_key):
-                        subrow = df_key.iloc[j]
-                        if pd.isna(subrow[0]):
-                            break
-                        if pd.notna(subrow[1]):
-                            has_options = True
-                            break
-                        j += 1
-
-                    if has_options:
-                        question_map[qid] = text
-            i += 1
-
-        # Only include questions that exist in the data columns
-        question_map = {qid: text for qid, text in question_map.items() if qid in data_columns}
-
-    # ----------------------------------------------------------------------------------
-    # Final sorting and recommendation tagging
-    # ----------------------------------------------------------------------------------
-    columns = sorted(question_map.keys(), key=lambda q: int(q[1:]))
-    question_pairs = [(qid, question_map[qid]) for qid in columns]
-
-    if data_format == 'qualtrics':
-        nps_recs = detect_nps_questions_qualtrics(df)
-        sc_recs = detect_single_choice_questions_qualtrics(df)
-        ms_recs = detect_multi_select_questions_qualtrics(df)
-        mx_recs = detect_matrix_questions_qualtrics(df)
-        recommendations = {qid: [] for qid, _ in question_pairs}
-        for q in nps_recs:
-            if q in recommendations: recommendations[q].append("nps")
-        for q in sc_recs:
-            if q in recommendations: recommendations[q].append("single_choice")
-        for q in ms_recs:
-            if q in recommendations: recommendations[q].append("multi_select")
-        for q in mx_recs:
-            if q in recommendations: recommendations[q].append("matrix")
-    else:
-        nps_recs = detect_nps_questions(df, df_key)
-        sc_recs = detect_single_choice_questions(df, df_key)
-        ms_recs = detect_multi_select_questions(df)
-        recommendations = {qid: [] for qid, _ in question_pairs}
-        for q in nps_recs:
-            if q in recommendations: recommendations[q].append("nps")
-        for q in sc_recs:
-            if q in recommendations: recommendations[q].append("single_choice")
-        for q in ms_recs:
-            if q in recommendations: recommendations[q].append("multi_select")
+    recommendations = schema.recommendations(qid for qid, _ in question_pairs)
 
     return render_template(
         'select_columns.html',
@@ -261,15 +187,12 @@ def genai():
         # No data uploaded → redirect user back to upload
         return redirect(url_for('index'))
 
-    # Optional: preload embeddings once (can skip for faster load)
+    # ✅ Warm the assistant cache: documents, embeddings and FAISS index are
+    # built once here and reused by every /chat message
     try:
-        rag = SurveyRAG(app.config['UPLOAD_FOLDER'], filename, sheet)
-        rag.load_excel()
-        rag.convert_to_documents(max_rows=None)
+        rag = get_survey_rag(app.config['UPLOAD_FOLDER'], filename, sheet)
         print("🧪 Rows passed to document encoder:", len(rag.documents))
         print("🧪 Debug: total rows in RAG dataframe:", len(rag.df))
-        rag.embed_documents()
-        rag.build_faiss_index()
     except Exception as e:
         return f"❌ Error preparing AI assistant: {str(e)}", 500
 
@@ -291,10 +214,8 @@ def chat():
 
     def generate():
         try:
-            # Load and prepare RAG context
-            rag = SurveyRAG(app.config['UPLOAD_FOLDER'], filename, sheet)
-            rag.load_excel()
-            rag.convert_to_documents(max_rows=None)
+            # ✅ Ready RAG context from the assistant cache (embedded on first use below)
+            rag = get_survey_rag(app.config['UPLOAD_FOLDER'], filename, sheet, embed=False)
             
             prompt = """
                 You are a helpful assistant analyzing structured survey data. Answer each user question clearly and concisely, using only the provided survey context.
@@ -326,7 +247,7 @@ def chat():
             system_prompt = prompt
             
             raw_df = rag.raw_df
-            key_df = rag.key_df
+            answer_key = rag.answer_key
 
             # 🔍 Very simple SQL-style query detection
             user_lower = user_query.lower()
@@ -345,7 +266,7 @@ def chat():
 
             if is_sql_like:
                 # 🧠 Use SQL Agent flow
-                sql_response = run_sql_agent(user_query, raw_df, key_df)
+                sql_response = run_sql_agent(user_query, raw_df, answer_key, rag.decoded_df)
 
                 # Stream result as a text block (you can later upgrade to table if it's a DataFrame)
                 for line in str(sql_response).splitlines():
@@ -354,8 +275,7 @@ def chat():
             
             if is_verbatim:
                 # 🔁 Fall back to RAG for verbatim-style answers
-                rag.embed_documents()
-                rag.build_faiss_index()
+                rag.prepare(embed=True)
 
                 top_chunks = rag.retrieve(user_query, top_k=5)
                 context = "\n---\n".join(top_chunks)
@@ -377,8 +297,7 @@ def chat():
                 return
 
             # 🧠 Else fallback to existing RAG-based logic
-            rag.embed_documents()
-            rag.build_faiss_index()
+            rag.prepare(embed=True)
 
             top_chunks = rag.retrieve(user_query, top_k=5)
             context = "\n---\n".join(top_chunks)
@@ -409,46 +328,6 @@ def chat():
 # -----------------------------------------
 # Renders selected question results
 # -----------------------------------------
-def get_question_text_from_key(df_key, qid):
-    for _, row in df_key.iterrows():
-        if pd.notna(row[0]) and str(row[0]).strip() == qid:
-            return str(row[1]).strip() if pd.notna(row[1]) else qid
-    return qid
-
-def get_question_text_from_raw(df_full: pd.DataFrame, qid: str) -> str:
-    """
-    Return the human-readable text for question `qid` from df_full,
-    which must have been loaded with header=row_of_Qcodes (so df_full.columns
-    are like 'Q1', 'Q2_1', 'Q2_2', …) and df_full.iloc[0] holds the question texts.
-    """
-    # 1) The row immediately below the header holds the question text
-    text_row = df_full.iloc[0]
-
-    # 2) Find all columns that start with this qid (e.g. 'Q2', 'Q2_1', 'Q2:sub', etc.)
-    pattern = re.compile(rf'^{re.escape(qid)}(?:[_:]\d+)?$')
-    cols = [c for c in df_full.columns if isinstance(c, str) and pattern.match(c)]
-    if not cols:
-        return qid  # no match → give back the qid itself
-
-    # 3) Pull their texts
-    texts = [ str(text_row[c]).strip() for c in cols ]
-
-    # 4) If only one column, that's the text
-    if len(texts) == 1:
-        return texts[0]
-
-    # 5) If multiple (e.g. multi-select), return the common prefix before ' - '
-    prefixes = [t.split(' - ')[0] for t in texts]
-    if len(set(prefixes)) == 1:
-        return prefixes[0]
-
-    # 6) Otherwise fall back to the longest common prefix of all full texts
-    shortest, longest = min(texts), max(texts)
-    for i, ch in enumerate(shortest):
-        if ch != longest[i]:
-            return shortest[:i].rstrip()
-    return shortest.rstrip()
-
 @app.route('/compare_multi_questions', methods=['POST'])
 def compare_multi_questions():
     filename = request.form['filename']
@@ -456,10 +335,6 @@ def compare_multi_questions():
     data_format = request.form.get('data_format', 'inquery')
     filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
 
-    df_full = pd.read_excel(filepath, sheet_name=sheet, header=2)
-    df = df_full.iloc[1:].reset_index(drop=True) if data_format == "qualtrics" else df_full
-    df_key = pd.read_excel(filepath, sheet_name="Answer key", header=None)
-
     # ------------------------
     # Filter inputs
     # ------------------------
@@ -486,160 +361,40 @@ def compare_multi_questions():
         if key.startswith("include_") and request.form.get(key)
     ]
 
-    results = []
-    all_columns = []
-
-    for q in questions:
-        types = list(dict.fromkeys(request.form.getlist(f"type_{q}")))
-        for q_type in types:
-            filters = deepcopy(base_filters)
-            filters['cut_column'] = request.form.get(f'cut_column_{q}', '')
-            filters['max_rank'] = request.form.get(f'max_rank_{q}', '')
-
-            try:
-                # ----------- Core branching by type and data format ------------
-                if q_type == 'cross_cut' and filters['cut_column']:
-                    if data_format == "qualtrics":
-                        html = process_cross_cut_qualtrics(filepath, sheet, q, filters)
-                    else:
-                        html = process_cross_cut(filepath, sheet, q, filters)
-                    question_text = f"Cross cut {q} x {filters['cut_column']} - Cross Cut Summary"
-
-                elif q_type == 'single_choice':
-                    if data_format == "qualtrics":
-                        html = process_single_choice_qualtrics(filepath, sheet, q, filters)
-                        question_text = get_question_text_from_raw(df_full, q)
-                    else:
-                        html = process_single_choice(filepath, sheet, q, filters)
-                        question_text = get_question_text_from_key(df_key, q)
-
-                elif q_type == 'matrix':
-                    if data_format == "qualtrics":
-                        html = process_matrix_question_qualtrics(filepath, sheet, q, filters)
-                        question_text = get_question_text_from_raw(df_full, q)
-                    else:
-                        html = process_matrix_question(filepath, sheet, q, filters)
-                        question_text = get_question_text_from_key(df_key, q)
-
-                elif q_type == 'multi_select':
-                    if data_format == "qualtrics":
-                        html = process_multi_select_qualtrics(filepath, sheet, q, filters)
-                        question_text = get_question_text_from_raw(df_full, q)
-                    else:
-                        html = process_multi_select(filepath, sheet, q, filters)
-                        question_text = get_question_text_from_key(df_key, q)
-
-                elif q_type == 'ranked':
-                    if data_format == "qualtrics":
-                        html = process_ranked_question_qualtrics(filepath, sheet, q, filters)
-                        question_text = get_question_text_from_raw(df_full, q)
-                    else:
-                        html = process_ranked_question(filepath, sheet, q, filters)
-                        question_text = get_question_text_from_key(df_key, q)
-
-                elif q_type == 'nps':
-                    if data_format == "qualtrics":
-                        html = process_nps_question_qualtrics(filepath, sheet, q, filters)
-                        question_text = get_question_text_from_raw(df_full, q)
-                    else:
-                        html = process_nps_question(filepath, sheet, q, filters)
-                        question_text = get_question_text_from_key(df_key, q)
-
-                elif q_type == 'sow':
-                    html = process_share_of_wallet(filepath, sheet, q, filters)
-                    question_text = get_question_text_from_key(df_key, q)
-
-                else:
-                    html = f"<p>Unsupported or incomplete type for {q}</p>"
-                    question_text = f"{q} - {q_type}"
-
-                results.append({'question': q, 'text': question_text, 'html': html})
-                all_columns.append(q)
-
-            except Exception as e:
-                results.append({
-                    'question': q,
-                    'text': f"{q} - {q_type}",
-                    'html': f"<p>Error processing {q} ({q_type}): {str(e)}</p>"
-                })
-
-    results.sort(key=lambda r: int(r['question'][1:]) if r['question'].startswith('Q') else 999)
+    # ✅ One dataset load (only the questions, cuts and filters on the page)
+    # + one filter pass for every (question, type)
+    jobs = build_jobs(request.form, questions, base_filters)
+    with pinned_dataset(filepath, sheet, data_format, qids=job_qids(jobs, base_filters)) as ds:
+        results, all_columns = render_questions(filepath, sheet, data_format, jobs, base_filters)
+    answer_key = ds.answer_key
 
     # -----------------------------
     # Build filterable column list
     # -----------------------------
-    filter_columns = []
-    seen = set()
-    for _, row in df_key.iterrows():
-        if pd.notna(row[0]) and re.match(r'^Q\d+$', str(row[0]).strip()):
-            code = str(row[0]).strip()
-            label = str(row[1]).strip() if pd.notna(row[1]) else code
-            if code not in seen:
-                filter_columns.append((code, label))
-                seen.add(code)
+    filter_columns = [
+        (code, answer_key.question_text(code, code))
+        for code in answer_key.question_ids(base_only=True)
+    ]
 
     # -----------------------------
     # Recommendation tagging
     # -----------------------------
-    recommendations = {code: [] for code, _ in filter_columns}
-    if data_format == 'qualtrics':
-        nps_recs = detect_nps_questions_qualtrics(df)
-        sc_recs = detect_single_choice_questions_qualtrics(df)
-        ms_recs = detect_multi_select_questions_qualtrics(df)
-        mx_recs = detect_matrix_questions_qualtrics(df)
-        for q in nps_recs:
-            if q in recommendations: recommendations[q].append("nps")
-        for q in sc_recs:
-            if q in recommendations: recommendations[q].append("single_choice")
-        for q in ms_recs:
-            if q in recommendations: recommendations[q].append("multi_select")
-        for q in mx_recs:
-            if q in recommendations: recommendations[q].append("matrix")
-    else:
-        nps_recs = detect_nps_questions(df, df_key)
-        sc_recs = detect_single_choice_questions(df, df_key)
-        ms_recs = detect_multi_select_questions(df)
-        for q in nps_recs:
-            if q in recommendations: recommendations[q].append("nps")
-        for q in sc_recs:
-            if q in recommendations: recommendations[q].append("single_choice")
-        for q in ms_recs:
-            if q in recommendations: recommendations[q].append("multi_select")
+    recommendations = ds.schema.recommendations(code for code, _ in filter_columns)
 
     # -----------------------------
     # If Qualtrics: override filter labels using VarInfo
     # -----------------------------
     question_text_map = {}
     if data_format == 'qualtrics':
-        try:
-            df_varinfo = pd.read_excel(filepath, sheet_name="Variable information", header=None)
-            from collections import defaultdict
-            grouped = defaultdict(list)
-
-            for _, row in df_varinfo.iterrows():
-                if pd.notna(row[0]) and pd.notna(row[2]):
-                    qid = str(row[0]).strip()
-                    if re.match(r"^Q\d+(_\d+)?$", qid):
-                        base_qid = qid.split("_")[0]
-                        grouped[base_qid].append(str(row[2]).strip())
-
-            def lcp(strs):
-                if not strs: return ""
-                s1, s2 = min(strs), max(strs)
-                for i, ch in enumerate(s1):
-                    if i >= len(s2) or ch != s2[i]:
-                        return s1[:i].rstrip(" :-–")
-                return s1.rstrip(" :-–")
-
-            for base_qid, texts in grouped.items():
-                question_text_map[base_qid] = lcp(texts)
-
-            filter_columns = [
-                (code, question_text_map.get(code, fallback))
-                for code, fallback in filter_columns
-            ]
-        except Exception as e:
-            print("Error reading VarInfo for filter labels:", e)
+        for code, _ in filter_columns:
+            texts = ds.schema.varinfo_texts(code, pattern=QUALTRICS_VARIABLE)
+            if texts:
+                question_text_map[code] = common_prefix(texts)
+
+        filter_columns = [
+            (code, question_text_map.get(code, fallback))
+            for code, fallback in filter_columns
+        ]
 
     return render_template(
         'display_multi_results.html',
@@ -664,15 +419,19 @@ def get_answer_key_values():
     filename = request.form.get("filename")
     question = request.form.get("question")
     data_format = request.form.get("data_format", "inquery")
+    sheet = request.form.get("sheet") or session.get("sheet")
     
     if not filename or not question:
         return jsonify([])
 
     try:
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        df_key = pd.read_excel(filepath, sheet_name="Answer key", header=None)
+        if sheet:
+            answer_key = load_answer_key(filepath, sheet, data_format)
+        else:
+            answer_key = AnswerKey(read_answer_key_sheet(filepath), data_format)
 
-        values = extract_answer_values(df_key, question, data_format)
+        values = extract_answer_values(answer_key, question)
         return jsonify(values)
 
     except Exception as e:
@@ -687,6 +446,7 @@ def get_answer_key_values():
 def download_all_excel():
     filename = request.form.get('filename')
     sheet = request.form.get('sheet')
+    data_format = request.form.get('data_format', 'inquery')
     filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
     question_ids = request.form.getlist("questions")
 
@@ -694,6 +454,7 @@ def download_all_excel():
     writer = pd.ExcelWriter(buffer, engine='openpyxl')
     question_text_map = {}
 
+    jobs = []
     for qid in question_ids:
         types = request.form.getlist(f"type_{qid}")
         filters = {
@@ -701,84 +462,94 @@ def download_all_excel():
             'filter_values': request.form.getlist('filter_value_0'),
             'sort_column': request.form.get('sort_column', '')
         }
-        filters['cut_column'] = request.form.get(f'cut_column_{qid}', '')
+        filters['cut_column'] = request.form.get(f'cut_column_{qid}', '') if 'cross_cut' in types else ''
+        filters['segment_column'] = request.form.get(f'segment_column_{qid}', '')
         filters['max_rank'] = request.form.get(f'max_rank_{qid}', '')
+        filters['sow_buckets'] = request.form.get(f'sow_buckets_{qid}', '')
+        jobs.extend((qid, qtype, filters) for qtype in types)
+
+    # ✅ All question data computed up front (worker pool for large exports), in order
+    outputs = compute_outputs(filepath, sheet, data_format, jobs)
+
+    for (qid, qtype, filters), (output, error) in zip(jobs, outputs):
+        try:
+            if error is not None:
+                raise RuntimeError(error)
+
+            # Build the tables from the precomputed data
+            if output is None:
+                df1 = pd.DataFrame([["Unsupported question type"]])
+                df2 = None
+
+            elif qtype == 'single_choice':
+                df1 = pd.DataFrame(output["response_summary"], columns=["Option", "Count", "Percentage"])
+                df2 = None
+
+            elif qtype == 'multi_select':
+                df1 = pd.DataFrame(output["response_summary"],
+                                   columns=["Option", "Count", "% Respondents", "% Responses"])
+                df2 = None
+
+            elif qtype == 'matrix':
+                df1 = pd.DataFrame(output["count_matrix"], columns=output["col_labels"])
+                df1.insert(0, "Label", output["row_labels"])
+                df2 = pd.DataFrame(
+                    list(output["percent_matrix"]) + [output["top_box"], output["bottom_box"]],
+                    columns=output["col_labels"]
+                )
+                df2.insert(0, "Label", list(output["row_labels"]) + ["Top-2 box", "Bottom-2 box"])
+
+            elif qtype == 'ranked':
+                df1 = pd.DataFrame([[label, total] + counts + [avg_rank, borda]
+                                    for (label, total, counts), (_, avg_rank, borda)
+                                    in zip(output["result_matrix"], output["rank_scores"])],
+                                   columns=["Label", "Total"] + output["rank_labels"] + ["Average Rank", "Borda Score"])
+                df2 = pd.DataFrame([[label, overall] + row for label, overall, row in output["percent_matrix"]],
+                                   columns=["Label", "Overall %"] + output["rank_labels"])
+
+            elif qtype == 'cross_cut':
+                df1 = pd.DataFrame([[label, total] + row for label, total, row in output["result_matrix"]],
+                                   columns=["Label", "Total"] + output["cut_headers"])
+                df2 = pd.DataFrame([[label, overall] + row for label, overall, row in output["percent_matrix"]],
+                                   columns=["Label", "Overall %"] + output["cut_headers"])
+
+            elif qtype == 'nps':
+                df1 = pd.DataFrame([[score] + row for score, row in output["result_matrix"]],
+                                   columns=["Score"] + output["col_labels"])
+                df2 = pd.DataFrame([
+                    ["Promoters"] + output["promoters"],
+                    ["Neutrals"] + output["neutrals"],
+                    ["Detractors"] + output["detractors"],
+                    ["NPS Score (%)"] + [val / 100 for val in output["nps_scores"]],
+                    ["Average Score"] + output["average_scores"]
+                ] + [
+                    [f"NPS Score (%) - {label}"] + [val / 100 for val in nps_row]
+                    for label, nps_row in zip(output["segment_labels"], output["segment_nps"])
+                ], columns=["Category"] + output["col_labels"])
+
+            elif qtype == 'sow':
+                df1 = pd.DataFrame(output["count_matrix"] + [output["mean_shares"], output["median_shares"]],
+                                   index=output["row_labels"] + ["Mean Share", "Median Share"],
+                                   columns=output["col_labels"]).reset_index().rename(columns={"index": "Range"})
+                df2 = None
+
+            sheet_name = f"{qid}_{qtype}"[:31]
+            question_text = output.get("question_text", f"{qid}: {qtype}") if output else f"{qid}: {qtype}"
+            question_text_map[sheet_name] = question_text
+
+            # Write count table
+            df1_start = 2
+            df1.to_excel(writer, sheet_name=sheet_name, index=False, startrow=df1_start)
+
+            # Write percentage table
+            df2_start = df1_start + len(df1) + 3 if df2 is not None else None
+            if df2 is not None:
+                df2.to_excel(writer, sheet_name=sheet_name, index=False, startrow=df2_start)
 
-        for qtype in types:
-            try:
-                # Load appropriate data
-                if qtype == 'single_choice':
-                    output = get_single_choice_data(filepath, sheet, qid, filters)
-                    df1 = pd.DataFrame(output["response_summary"], columns=["Option", "Count", "Percentage"])
-                    df2 = None
-
-                elif qtype == 'multi_select':
-                    output = get_multi_select_data(filepath, sheet, qid, filters)
-                    df1 = pd.DataFrame(output["response_summary"],
-                                       columns=["Option", "Count", "% Respondents", "% Responses"])
-                    df2 = None
-
-                elif qtype == 'matrix':
-                    output = get_matrix_question_data(filepath, sheet, qid, filters)
-                    df1 = pd.DataFrame(output["count_matrix"], columns=output["col_labels"])
-                    df1.insert(0, "Label", output["row_labels"])
-                    df2 = pd.DataFrame(output["percent_matrix"], columns=output["col_labels"])
-                    df2.insert(0, "Label", output["row_labels"])
-
-                elif qtype == 'ranked':
-                    output = get_ranked_data(filepath, sheet, qid, filters)
-                    df1 = pd.DataFrame([[label, total] + counts for label, total, counts in output["result_matrix"]],
-                                       columns=["Label", "Total"] + output["rank_labels"])
-                    df2 = pd.DataFrame([[label, overall] + row for label, overall, row in output["percent_matrix"]],
-                                       columns=["Label", "Overall %"] + output["rank_labels"])
-
-                elif qtype == 'cross_cut':
-                    output = get_cross_cut_data(filepath, sheet, qid, filters)
-                    df1 = pd.DataFrame([[label, total] + row for label, total, row in output["result_matrix"]],
-                                       columns=["Label", "Total"] + output["cut_headers"])
-                    df2 = pd.DataFrame([[label, overall] + row for label, overall, row in output["percent_matrix"]],
-                                       columns=["Label", "Overall %"] + output["cut_headers"])
-
-                elif qtype == 'nps':
-                    output = get_nps_data(filepath, sheet, qid, filters)
-                    df1 = pd.DataFrame([[score] + row for score, row in output["result_matrix"]],
-                                       columns=["Score"] + output["col_labels"])
-                    df2 = pd.DataFrame([
-                        ["Promoters"] + output["promoters"],
-                        ["Neutrals"] + output["neutrals"],
-                        ["Detractors"] + output["detractors"],
-                        ["NPS Score (%)"] + [val / 100 for val in output["nps_scores"]],
-                        ["Average Score"] + output["average_scores"]
-                    ], columns=["Category"] + output["col_labels"])
-
-                elif qtype == 'sow':
-                    output = get_sow_data(filepath, sheet, qid, filters)
-                    df1 = pd.DataFrame(output["count_matrix"],
-                                       index=output["row_labels"],
-                                       columns=output["col_labels"]).reset_index().rename(columns={"index": "Range"})
-                    df2 = None
-
-                else:
-                    df1 = pd.DataFrame([["Unsupported question type"]])
-                    df2 = None
-
-                sheet_name = f"{qid}_{qtype}"[:31]
-                question_text = output.get("question_text", f"{qid}: {qtype}")
-                question_text_map[sheet_name] = question_text
-
-                # Write count table
-                df1_start = 2
-                df1.to_excel(writer, sheet_name=sheet_name, index=False, startrow=df1_start)
-
-                # Write percentage table
-                df2_start = df1_start + len(df1) + 3 if df2 is not None else None
-                if df2 is not None:
-                    df2.to_excel(writer, sheet_name=sheet_name, index=False, startrow=df2_start)
-
-            except Exception as e:
-                sheet_name = f"{qid}_{qtype}"[:31]
-                question_text_map[sheet_name] = f"Error processing {qid}: {str(e)}"
-                pd.DataFrame([[f"Error processing {qid}: {str(e)}"]]).to_excel(writer, sheet_name=sheet_name, index=False)
+        except Exception as e:
+            sheet_name = f"{qid}_{qtype}"[:31]
+            question_text_map[sheet_name] = f"Error processing {qid}: {str(e)}"
+            pd.DataFrame([[f"Error processing {qid}: {str(e)}"]]).to_excel(writer, sheet_name=sheet_name, index=False)
 
     writer.close()
     buffer.seek(0)
@@ -854,6 +625,7 @@ def download_all_excel():
 def download_thinkcell_ppt():
     filename = request.form.get("filename")
     sheet = request.form.get("sheet")
+    data_format = request.form.get("data_format", "inquery")
     filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
 
     filters = {
@@ -868,6 +640,7 @@ def download_thinkcell_ppt():
     template_map = {
         "nps": "NPS.pptx",
         "matrix": "Matrix.pptx",
+        "cross_cut": "Matrix.pptx",
         "single_choice": "Single.pptx"
     }
 
@@ -875,6 +648,7 @@ def download_thinkcell_ppt():
     blocks_by_type = {
         "nps": [],
         "matrix": [],
+        "cross_cut": [],
         "single_choice": []
     }
 
@@ -882,7 +656,7 @@ def download_thinkcell_ppt():
 
     for qid in questions:
         types = request.form.getlist(f"type_{qid}")
-        filters["cut_column"] = request.form.get(f'cut_column_{qid}', '')
+        filters["cut_column"] = request.form.get(f'cut_column_{qid}', '') if "cross_cut" in types else ''
         filters["max_rank"] = request.form.get(f'max_rank_{qid}', '')
 
         try:
@@ -904,6 +678,13 @@ def download_thinkcell_ppt():
                     "data": [{"name": k, "table": v} for k, v in chart_data.items()]
                 })
 
+            elif "cross_cut" in types and filters["cut_column"]:
+                chart_data = build_cross_cut_slide(filepath, sheet, qid, filters, data_format)
+                blocks_by_type["cross_cut"].append({
+                    "slide": 1,
+                    "data": [{"name": k, "table": v} for k, v in chart_data.items()]
+                })
+
         except Exception as e:
             print(f"❌ Failed to build {types[0]} for {qid}: {e}")
 
@@ -0,0 +1,78 @@
+"""
+Recall vs latency of the RAG index types (ann_index) against the exact flat
+index, on synthetic clustered embeddings (respondent documents are highly
+redundant, so their vectors form tight clusters).
+
+    python bench_ann_index.py                        # 20k and 100k vectors, 1536 dims
+    python bench_ann_index.py --docs 200000 --dim 1536 --queries 200
+"""
+import argparse
+import time
+
+import numpy as np
+
+from ann_index import build_index, configure_search
+
+SWEEPS = {
+    "hnsw": ("ef_search", [16, 64, 256]),
+    "ivf_flat": ("nprobe", [4, 16, 64]),
+    "ivf_pq": ("nprobe", [4, 16, 64]),
+}
+
+
+def synthetic_embeddings(n, dim, n_clusters=200, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, n_clusters, n)
+    vectors = centers[labels] + 0.35 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def search_one_by_one(index, queries, k):
+    """Queries are issued one at a time, the way /chat does; returns (ids, ms per query)."""
+    ids = np.empty((len(queries), k), dtype=np.int64)
+    start = time.perf_counter()
+    for i, query in enumerate(queries):
+        ids[i] = index.search(query[None, :], k)[1][0]
+    return ids, (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def recall(found, truth):
+    return np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, nargs="+", default=[20_000, 100_000])
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--types", nargs="+", default=list(SWEEPS), choices=list(SWEEPS))
+    args = parser.parse_args()
+
+    for n in args.docs:
+        vectors = synthetic_embeddings(n + args.queries, args.dim)
+        corpus, queries = vectors[:n], vectors[n:]
+        print(f"\n{n:,} vectors x {args.dim} dims, {args.queries} queries, recall@{args.k}")
+
+        start = time.perf_counter()
+        flat = build_index(corpus, "flat")
+        print(f"  flat built in {time.perf_counter() - start:.1f}s")
+        truth, flat_ms = search_one_by_one(flat, queries, args.k)
+        print(f"  {'flat':<10} {'exact':<14} {flat_ms:8.3f} ms/query   recall 1.000")
+
+        for kind in args.types:
+            knob, values = SWEEPS[kind]
+            start = time.perf_counter()
+            index = build_index(corpus, kind)
+            print(f"  {kind} built in {time.perf_counter() - start:.1f}s")
+            for value in values:
+                configure_search(index, **{knob: value})
+                found, ms = search_one_by_one(index, queries, args.k)
+                label = f"{knob}={value}"
+                print(f"  {kind:<10} {label:<14} {ms:8.3f} ms/query   "
+                      f"recall {recall(found, truth):.3f}   {flat_ms / ms:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Cold embedding of a synthetic respondent corpus against a local stub of the
+OpenAI embeddings endpoint: the previous pipeline (batches of 100, one at a
+time) vs openai_embeddings.embed_texts (token-sized batches, concurrent,
+shared client, backoff). The stub charges a fixed latency per request plus
+per token and answers a share of requests with 429 + Retry-After.
+
+    python bench_embeddings.py                       # 20k documents
+    python bench_embeddings.py --docs 5000 --latency 0.3 --rate-limited 0.1
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+def stub_server(latency, per_token, rate_limited, dim):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            inputs = body["input"]
+            if random.random() < rate_limited:
+                self._reply(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                            {"retry-after": "0.2"})
+                return
+            time.sleep(latency + per_token * sum(len(text) // 4 for text in inputs))
+            data = [{"object": "embedding", "index": i, "embedding": [float(len(text) % 7)] * dim}
+                    for i, text in enumerate(inputs)]
+            self._reply(200, {"object": "list", "data": data, "model": body["model"],
+                              "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+
+        def _reply(self, status, payload, headers=None):
+            out = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(out)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def synthetic_documents(n, seed=0):
+    rng = random.Random(seed)
+    brands = ["ABB", "Siemens", "GE", "Schneider"]
+    return [
+        f"Response {i + 1}\nQ1: {rng.choice(['North', 'South', 'East'])}\nQ2: {rng.choice(['Male', 'Female'])}\n"
+        + "\n".join(f"Q4 | {b}: {rng.randint(0, 10)}" for b in brands)
+        + ("\nQ8: " + " ".join(rng.choice(["great", "service", "slow", "price", "support"]) for _ in range(30))
+           if i % 3 == 0 else "")
+        for i in range(n)
+    ]
+
+
+def sequential_embeddings(texts, model, batch_size=100):
+    """The previous SurveyRAG.get_openai_embeddings: a new client, one batch at a time."""
+    from openai import OpenAI
+    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    embeddings = []
+    for i in range(0, len(texts), batch_size):
+        response = client.embeddings.create(input=texts[i:i + batch_size], model=model)
+        embeddings.extend(record.embedding for record in response.data)
+    return embeddings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=20_000)
+    parser.add_argument("--latency", type=float, default=0.15, help="seconds per request")
+    parser.add_argument("--per-token", type=float, default=2e-6, help="seconds per input token")
+    parser.add_argument("--rate-limited", type=float, default=0.05, help="share of requests answered 429")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--dim", type=int, default=8)
+    args = parser.parse_args()
+
+    server = stub_server(args.latency, args.per_token, args.rate_limited, args.dim)
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-stub")
+    from openai_embeddings import EMBEDDING_MODEL, embed_texts, token_batches
+
+    texts = synthetic_documents(args.docs)
+    print(f"{len(texts):,} documents, {len(token_batches(texts))} token-sized batches, "
+          f"stub latency {args.latency}s/request, {args.rate_limited:.0%} rate-limited")
+
+    start = time.perf_counter()
+    try:
+        baseline = np.asarray(sequential_embeddings(texts, EMBEDDING_MODEL), dtype=np.float32)
+        sequential_s = time.perf_counter() - start
+        print(f"  sequential, 100/batch   {sequential_s:7.2f}s")
+    except Exception as e:  # the old loop relied on the SDK's 2 retries
+        baseline, sequential_s = None, None
+        print(f"  sequential, 100/batch   failed: {type(e).__name__}")
+
+    for concurrency in args.concurrency:
+        start = time.perf_counter()
+        vectors = embed_texts(texts, EMBEDDING_MODEL, concurrency=concurrency)
+        elapsed = time.perf_counter() - start
+        speedup = f"{sequential_s / elapsed:5.1f}x" if sequential_s else ""
+        same = "" if baseline is None or np.array_equal(vectors, baseline) else "   ⚠️ vectors differ"
+        print(f"  embed_texts, {concurrency} in flight {elapsed:7.2f}s   {speedup}{same}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Benchmark the xlsx reader backends (and the same data uploaded as CSV, and
+the Parquet sidecar) on synthetic InQuery-style survey workbooks.
+
+    python bench_xlsx_readers.py                   # 10k and 100k rows
+    python bench_xlsx_readers.py --rows 5000 --repeat 3
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+from flat_reader import read_delimited
+from xlsx_reader import available_readers, open_workbook
+
+BRANDS = ["Alpha", "Beta", "Gamma", "Delta", "Epsilon"]
+STATEMENTS = ["Quality", "Price", "Service", "Range", "Trust", "Speed"]
+
+
+def survey_columns():
+    cols = ["Respondent", "Q1", "Q2"]
+    cols += [f"Q3: {b}" for b in BRANDS]
+    cols += [f"Q4 | {b}" for b in BRANDS]
+    cols += [f"Q5: {s}" for s in STATEMENTS]
+    cols += [f"Q6: {b}" for b in BRANDS[:4]]
+    cols += [f"Q7: {b}" for b in BRANDS[:4]]
+    cols += ["Q8"]
+    return cols
+
+
+def write_workbook(path, n_rows, seed=0):
+    """Raw data (question codes on row 3) + Answer key, written in streaming mode."""
+    rng = np.random.default_rng(seed)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Raw data")
+    ws.append(["Synthetic survey"])
+    ws.append([])
+    ws.append(survey_columns())
+
+    q1 = rng.integers(1, 4, n_rows)
+    q2 = rng.integers(1, 3, n_rows)
+    q3 = rng.random((n_rows, len(BRANDS))) < 0.4
+    q4 = rng.integers(1, 12, (n_rows, len(BRANDS)))
+    q5 = rng.integers(1, 6, (n_rows, len(STATEMENTS)))
+    q6 = np.argsort(rng.random((n_rows, 4)), axis=1) + 1
+    q7 = rng.dirichlet(np.ones(4), n_rows) * 100
+    for i in range(n_rows):
+        row = [i + 1, int(q1[i]), int(q2[i])]
+        row += [1 if flag else None for flag in q3[i]]
+        row += q4[i].tolist() + q5[i].tolist() + q6[i].tolist()
+        row += np.round(q7[i], 1).tolist()
+        row.append(f"Comment {i}" if i % 7 == 0 else None)
+        ws.append(row)
+
+    key = wb.create_sheet("Answer key")
+    blocks = [
+        ("Q1", "Region", ["North", "South", "East"]),
+        ("Q2", "Gender", ["Male", "Female"]),
+        ("Q3", "Brands used", BRANDS),
+        ("Q4", "Likelihood to recommend", [str(s) for s in range(11)]),
+        ("Q5", "Agreement", ["Strongly disagree", "Disagree", "Neutral", "Agree", "Strongly agree"]),
+    ]
+    for qid, text, labels in blocks:
+        key.append([qid, text])
+        for code, label in enumerate(labels, start=1):
+            key.append([code, label])
+        key.append([])
+    wb.save(path)
+
+
+def time_reader(path, reader, repeat):
+    best, frames = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with open_workbook(path, reader) as xls:
+            frames = (xls.parse("Raw data", header=2), xls.parse("Answer key", header=None))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, frames
+
+
+def time_csv(raw_df, workdir, repeat):
+    path = os.path.join(workdir, "raw.csv")
+    raw_df.to_csv(path, index=False)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        read_delimited(path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def time_sidecar(raw_df, key_df, workdir, repeat):
+    raw_path, key_path = os.path.join(workdir, "raw.parquet"), os.path.join(workdir, "key.pkl")
+    raw_df.to_parquet(raw_path, index=False)
+    key_df.to_pickle(key_path)  # the Answer key mixes codes and labels, as in dataset._save_frame
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pd.read_parquet(raw_path)
+        pd.read_pickle(key_path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    readers = available_readers()
+    print(f"Readers installed: {', '.join(readers)}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for n_rows in args.rows:
+            path = os.path.join(workdir, f"survey_{n_rows}.xlsx")
+            start = time.perf_counter()
+            write_workbook(path, n_rows)
+            size_mb = os.path.getsize(path) / 1e6
+            print(f"\n{n_rows:,} rows ({size_mb:.1f} MB, written in {time.perf_counter() - start:.1f}s)")
+
+            results, reference = {}, None
+            for reader in readers:
+                elapsed, frames = time_reader(path, reader, args.repeat)
+                results[reader] = elapsed
+                if reference is None:
+                    reference = frames
+                elif not (frames[0].equals(reference[0]) and frames[1].equals(reference[1])):
+                    print(f"  ⚠️ {reader} frames differ from {readers[0]}")
+            results["csv upload"] = time_csv(reference[0], workdir, args.repeat)
+            results["parquet sidecar"] = time_sidecar(*reference, workdir, args.repeat)
+
+            slowest = max(results.values())
+            for name, elapsed in results.items():
+                print(f"  {name:<16} {elapsed:8.3f}s   {slowest / elapsed:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
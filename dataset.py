@@ -0,0 +1,445 @@
+import hashlib
+import multiprocessing as mp
+import os
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from xml.etree import ElementTree
+
+import pandas as pd
+
+from answer_key import AnswerKey, normalize_code
+from dtype_plan import compact_frame
+from filter_index import FilterIndex
+from flat_reader import FLAT_FILE_SHEET, is_flat_file, read_companion, read_flat_upload, source_files
+from question_scanner import QuestionScan
+from schema_catalog import SchemaCatalog
+from xlsx_reader import open_workbook, read_sheet
+
+DATASET_CACHE_DIR = os.path.join("cache", "datasets")
+MAX_CACHED_DATASETS = 8
+# Column-projected datasets (see load_projected), keyed by their QID set
+MAX_CACHED_PROJECTIONS = 16
+# Worker processes for parsing a workbook's sheets come from the PARSE_WORKERS
+# env var (read per call, so .env works): 1 = sequential (default), 0 = one per
+# sheet up to the CPU count. Off by default: it forks the whole server process
+DEFAULT_PARSE_WORKERS = 1
+# Below this size the sheets are parsed one after another from a single open workbook
+PARALLEL_PARSE_MIN_BYTES = 4 * 1024 * 1024
+
+_datasets = OrderedDict()
+_projections = OrderedDict()
+_datasets_lock = threading.Lock()
+_load_locks = {}
+_hash_memo = {}
+_pinned = threading.local()
+
+
+def _reset_lock_after_fork():
+    global _datasets_lock
+    _datasets_lock = threading.Lock()
+    _load_locks.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_lock_after_fork)
+
+
+class SurveyDataset:
+    """
+    One parsed upload: the raw data sheet plus its Answer key (and, for
+    Qualtrics exports, the Variable information sheet).
+
+    Instances are shared between requests — treat the frames as read-only.
+    `schema` is the persisted SchemaCatalog when there is one; otherwise it is
+    built from the frames. Coded columns are cast to compact dtypes (see
+    dtype_plan), so `df` holds int8/UInt8/category columns rather than float64.
+    """
+
+    def __init__(self, raw_df, key_df, varinfo_df, data_format, file_hash, sheet, schema=None):
+        self.key_df = key_df
+        self.varinfo_df = varinfo_df
+        self.data_format = data_format
+        self.file_hash = file_hash
+        self.sheet = sheet
+        self.answer_key = AnswerKey(key_df, data_format)
+
+        # Qualtrics puts the question text in the first row under the Q-codes;
+        # only that row is kept, not the object-dtype frame it came with
+        if data_format == "qualtrics":
+            self.question_text_row = raw_df.iloc[0] if len(raw_df) else None
+            self.df = raw_df.iloc[1:].reset_index(drop=True)
+        else:
+            self.question_text_row = None
+            self.df = raw_df
+
+        self.value_labels = build_value_labels(varinfo_df)
+        self._question_scan = None
+        self.schema = schema or SchemaCatalog.build(self)
+
+        self.df = compact_frame(self.df, self.answer_key, self.schema)
+        self.raw_df = self.df
+        self.filter_index = FilterIndex(self.df, self.answer_key, self.schema)
+
+    @property
+    def question_scan(self) -> QuestionScan:
+        """Question-type recommendations, scanned on first use and kept with the dataset."""
+        if self._question_scan is None:
+            self._question_scan = QuestionScan(self.df, self.answer_key, self.data_format)
+        return self._question_scan
+
+
+def build_value_labels(varinfo_df) -> dict:
+    """
+    {(column, normalized code): label} from the Variable information sheet
+    (col A = raw column name, col B = code, col C = label text).
+    """
+    labels = {}
+    if varinfo_df is None or varinfo_df.shape[1] < 3:
+        return labels
+    coded = varinfo_df[varinfo_df[0].notna() & varinfo_df[1].notna() & varinfo_df[2].notna()]
+    for col, code, label in zip(coded[0], coded[1], coded[2]):
+        labels.setdefault((str(col).strip(), normalize_code(code)), str(label).strip())
+    return labels
+
+
+def file_hash(filepath: str) -> str:
+    """
+    SHA-1 of the file content (plus the companion files of a CSV/TSV/Parquet
+    upload), memoized on (size, mtime) so repeat requests don't re-read the upload.
+    """
+    path = os.path.abspath(filepath)
+    sources = source_files(path)
+    stats = [os.stat(source) for source in sources]
+    stamp = tuple((source, stat.st_size, stat.st_mtime_ns) for source, stat in zip(sources, stats))
+
+    memo = _hash_memo.get(path)
+    if memo and memo[0] == stamp:
+        return memo[1]
+
+    sha = hashlib.sha1()
+    for source in sources:
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+    digest = sha.hexdigest()
+    _hash_memo[path] = (stamp, digest)
+    return digest
+
+
+def _cache_base(digest: str, sheet: str, data_format: str) -> str:
+    safe_sheet = re.sub(r"\W+", "_", sheet).strip("_")
+    return os.path.join(DATASET_CACHE_DIR, f"{digest[:20]}_{safe_sheet}_{data_format}")
+
+
+def _save_frame(df: pd.DataFrame, base: str):
+    """
+    Persist as Parquet; frames Arrow can't represent (mixed text/number
+    columns, e.g. the Qualtrics text row or the Answer key) fall back to pickle.
+    """
+    out = df.copy(deep=False)
+    out.columns = [str(c) for c in df.columns]
+    try:
+        out.to_parquet(base + ".parquet", index=False)
+    except (ImportError, ValueError, TypeError):
+        if os.path.exists(base + ".parquet"):
+            os.remove(base + ".parquet")
+        df.to_pickle(base + ".pkl")
+
+
+def _load_frame(base: str, positional: bool = False, columns=None):
+    """
+    positional: the sheet was read with header=None, so restore 0..n column labels.
+    columns: read only these from a Parquet sidecar (a pickle is always read whole).
+    """
+    if os.path.exists(base + ".parquet"):
+        df = pd.read_parquet(base + ".parquet", columns=columns)
+        if positional:
+            df.columns = range(len(df.columns))
+        return df
+    if os.path.exists(base + ".pkl"):
+        return pd.read_pickle(base + ".pkl")
+    return None
+
+
+def list_sheets(filepath: str) -> list:
+    """
+    Sheet names in workbook order. For .xlsx only the xl/workbook.xml manifest
+    is read from the zip, so this is instant whatever the size of the data;
+    other files (or an unreadable manifest) are opened with the xlsx reader.
+    CSV/TSV/Parquet uploads have the one FLAT_FILE_SHEET.
+    """
+    if is_flat_file(filepath):
+        return [FLAT_FILE_SHEET]
+    try:
+        with zipfile.ZipFile(filepath) as zf:
+            root = ElementTree.fromstring(zf.read("xl/workbook.xml"))
+        names = [el.get("name") for el in root.iter() if el.tag.rsplit("}", 1)[-1] == "sheet"]
+        if names:
+            return names
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError, OSError):
+        pass
+    with open_workbook(filepath) as xls:
+        return list(xls.sheet_names)
+
+
+def _parse_sheet(filepath: str, sheet: str, header):
+    with open_workbook(filepath) as xls:
+        return xls.parse(sheet, header=header)
+
+
+def _parse_workers(filepath: str, n_sheets: int) -> int:
+    try:
+        workers = int(os.getenv("PARSE_WORKERS", DEFAULT_PARSE_WORKERS))
+    except ValueError:
+        workers = DEFAULT_PARSE_WORKERS
+    if workers <= 0:
+        workers = n_sheets
+    if workers <= 1 or "fork" not in mp.get_all_start_methods() \
+            or os.path.getsize(filepath) < PARALLEL_PARSE_MIN_BYTES:
+        return 1
+    return max(1, min(workers, n_sheets, os.cpu_count() or 1))
+
+
+def _parse_workbook(filepath: str, sheet: str, data_format: str):
+    """
+    (raw_df, key_df, varinfo_df) for one upload, parsed from a single open
+    workbook. With PARSE_WORKERS set, large workbooks are parsed in one forked
+    process per sheet instead (the readers hold the GIL, so threads would not
+    overlap); each child re-opens the file and pickles its frame back.
+    CSV/TSV/Parquet uploads are read by flat_reader instead.
+    """
+    if is_flat_file(filepath):
+        return read_flat_upload(filepath, data_format)
+
+    jobs = [(sheet, 2), ("Answer key", None)]
+    if data_format == "qualtrics" and "Variable information" in list_sheets(filepath):
+        jobs.append(("Variable information", None))
+
+    workers = _parse_workers(filepath, len(jobs))
+    frames = None
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("fork")) as pool:
+                futures = [pool.submit(_parse_sheet, filepath, name, header) for name, header in jobs]
+                frames = [f.result() for f in futures]
+        except (BrokenProcessPool, OSError, ValueError) as e:
+            print("⚠️ Parallel sheet parsing failed, parsing sequentially:", e)
+    if frames is None:
+        with open_workbook(filepath) as xls:
+            frames = [xls.parse(name, header=header) for name, header in jobs]
+
+    raw_df, key_df = frames[0], frames[1]
+    varinfo_df = frames[2] if len(frames) > 2 else None
+    return raw_df, key_df, varinfo_df
+
+
+def _read_persisted(base: str, data_format: str):
+    raw_df = _load_frame(base + "_raw")
+    key_df = _load_frame(base + "_key", positional=True)
+    if raw_df is None or key_df is None:
+        return None
+    varinfo_df = _load_frame(base + "_varinfo", positional=True) if data_format == "qualtrics" else None
+    return raw_df, key_df, varinfo_df
+
+
+def _persist_schema(base: str, schema: SchemaCatalog):
+    try:
+        os.makedirs(DATASET_CACHE_DIR, exist_ok=True)
+        schema.save(base + "_schema.json")
+    except OSError as e:
+        print("⚠️ Could not persist schema catalog:", e)
+
+
+def _persist(base: str, raw_df, key_df, varinfo_df):
+    try:
+        os.makedirs(DATASET_CACHE_DIR, exist_ok=True)
+        _save_frame(raw_df, base + "_raw")
+        _save_frame(key_df, base + "_key")
+        if varinfo_df is not None:
+            _save_frame(varinfo_df, base + "_varinfo")
+    except OSError as e:
+        print("⚠️ Could not persist dataset cache:", e)
+
+
+def load_dataset(filepath: str, sheet: str, data_format: str = "inquery", progress=None) -> SurveyDataset:
+    """
+    Return the parsed dataset for (file content, sheet, data_format).
+
+    Lookup order: in-process LRU → columnar sidecar under cache/datasets →
+    parse the workbook (and write the sidecar for next time). The schema
+    catalog is persisted next to the sidecar and only rebuilt with it.
+    `progress(stage)` is called when an uncached load moves on to "index".
+    """
+    pinned_ds = getattr(_pinned, "datasets", {}).get((os.path.abspath(filepath), sheet, data_format))
+    if pinned_ds is not None:
+        return pinned_ds
+
+    digest = file_hash(filepath)
+    key = (digest, sheet, data_format)
+
+    with _datasets_lock:
+        ds = _datasets.get(key)
+        if ds is not None:
+            _datasets.move_to_end(key)
+            return ds
+        load_lock = _load_locks.setdefault(key, threading.Lock())
+
+    # One parse per key: a request arriving while the upload prefetch is still
+    # parsing waits for it instead of parsing the workbook a second time
+    with load_lock:
+        with _datasets_lock:
+            ds = _datasets.get(key)
+            if ds is not None:
+                _datasets.move_to_end(key)
+                return ds
+        return _load_uncached(filepath, sheet, data_format, digest, key, progress)
+
+
+def _load_uncached(filepath, sheet, data_format, digest, key, progress=None) -> SurveyDataset:
+    base = _cache_base(digest, sheet, data_format)
+    frames = _read_persisted(base, data_format)
+    schema = None
+    parsed = frames is None
+    if parsed:
+        frames = _parse_workbook(filepath, sheet, data_format)
+    else:
+        schema = SchemaCatalog.load(base + "_schema.json")
+
+    if progress:
+        progress("index")
+    ds = SurveyDataset(*frames, data_format=data_format, file_hash=digest, sheet=sheet, schema=schema)
+    if parsed:
+        # InQuery is persisted compact, so reloading casts nothing; Qualtrics
+        # keeps the parsed frame with its question-text row for the next load
+        _persist(base, frames[0] if data_format == "qualtrics" else ds.df, ds.key_df, ds.varinfo_df)
+    if schema is None:
+        _persist_schema(base, ds.schema)
+
+    with _datasets_lock:
+        _datasets[key] = ds
+        _datasets.move_to_end(key)
+        while len(_datasets) > MAX_CACHED_DATASETS:
+            _datasets.popitem(last=False)
+        _load_locks.pop(key, None)
+    return ds
+
+
+def _loaded(filepath: str, sheet: str, data_format: str):
+    """(the pinned or LRU-cached full dataset, or None; the upload's content hash)."""
+    pinned_ds = getattr(_pinned, "datasets", {}).get((os.path.abspath(filepath), sheet, data_format))
+    if pinned_ds is not None:
+        return pinned_ds, pinned_ds.file_hash
+
+    digest = file_hash(filepath)
+    key = (digest, sheet, data_format)
+    with _datasets_lock:
+        ds = _datasets.get(key)
+        if ds is not None:
+            _datasets.move_to_end(key)
+    return ds, digest
+
+
+def load_schema(filepath: str, sheet: str, data_format: str = "inquery") -> SchemaCatalog:
+    """The upload's SchemaCatalog; the persisted one is read without touching the data."""
+    ds, digest = _loaded(filepath, sheet, data_format)
+    if ds is not None:
+        return ds.schema
+    schema = SchemaCatalog.load(_cache_base(digest, sheet, data_format) + "_schema.json")
+    return schema or load_dataset(filepath, sheet, data_format).schema
+
+
+def load_answer_key(filepath: str, sheet: str, data_format: str = "inquery") -> AnswerKey:
+    """
+    The upload's Answer key: from the loaded dataset, else its sidecar, else
+    parsed from the 'Answer key' sheet alone — never the data sheet.
+    """
+    ds, digest = _loaded(filepath, sheet, data_format)
+    if ds is not None:
+        return ds.answer_key
+    key_df = _load_frame(_cache_base(digest, sheet, data_format) + "_key", positional=True)
+    if key_df is None:
+        key_df = read_answer_key_sheet(filepath)
+    return AnswerKey(key_df, data_format)
+
+
+def read_answer_key_sheet(filepath: str) -> pd.DataFrame:
+    """The raw 'Answer key' sheet (header=None), or a flat upload's Answer key companion."""
+    if is_flat_file(filepath):
+        key_df = read_companion(filepath, "answer_key")
+        return key_df if key_df is not None else pd.DataFrame()
+    return read_sheet(filepath, "Answer key", header=None)
+
+
+def load_projected(filepath: str, sheet: str, data_format: str = "inquery", qids=()) -> SurveyDataset:
+    """
+    A dataset with only the columns of `qids` (the questions, filter and cut
+    QIDs of one request): their own columns, sub-columns and loop copies,
+    read from the Parquet sidecar with the persisted schema. The Answer key,
+    Variable information and schema are the full ones.
+
+    Falls back to load_dataset when the full dataset is already in memory or
+    there is no Parquet sidecar / schema yet (first load, Qualtrics uploads
+    whose text row makes the sidecar a pickle).
+    """
+    ds, digest = _loaded(filepath, sheet, data_format)
+    if ds is not None:
+        return ds
+
+    key = (digest, sheet, data_format, tuple(sorted({qid for qid in qids if qid})))
+    with _datasets_lock:
+        ds = _projections.get(key)
+        if ds is not None:
+            _projections.move_to_end(key)
+            return ds
+
+    base = _cache_base(digest, sheet, data_format)
+    schema = SchemaCatalog.load(base + "_schema.json")
+    columns = schema.columns_for_questions(key[3]) if schema else []
+    if not columns or not os.path.exists(base + "_raw.parquet"):
+        return load_dataset(filepath, sheet, data_format)
+
+    key_df = _load_frame(base + "_key", positional=True)
+    if key_df is None:
+        return load_dataset(filepath, sheet, data_format)
+    raw_df = _load_frame(base + "_raw", columns=columns)
+    varinfo_df = _load_frame(base + "_varinfo", positional=True) if data_format == "qualtrics" else None
+    ds = SurveyDataset(raw_df, key_df, varinfo_df, data_format=data_format, file_hash=digest, sheet=sheet, schema=schema)
+
+    with _datasets_lock:
+        _projections[key] = ds
+        _projections.move_to_end(key)
+        while len(_projections) > MAX_CACHED_PROJECTIONS:
+            _projections.popitem(last=False)
+    return ds
+
+
+@contextmanager
+def pinned_dataset(filepath: str, sheet: str, data_format: str = "inquery", qids=None):
+    """
+    Load the dataset once and, for the rest of the block, serve every
+    load_dataset(filepath, sheet, data_format) call in this thread from that
+    instance — no re-hashing of the upload, and LRU eviction can't force a
+    reload halfway through a batch. With `qids`, the pinned dataset is the
+    load_projected one for those questions.
+    """
+    if qids is None:
+        ds = load_dataset(filepath, sheet, data_format)
+    else:
+        ds = load_projected(filepath, sheet, data_format, qids)
+    if not hasattr(_pinned, "datasets"):
+        _pinned.datasets = {}
+    key = (os.path.abspath(filepath), sheet, data_format)
+    previous = _pinned.datasets.get(key)
+    _pinned.datasets[key] = ds
+    try:
+        yield ds
+    finally:
+        if previous is None:
+            _pinned.datasets.pop(key, None)
+        else:
+            _pinned.datasets[key] = previous
@@ -0,0 +1,94 @@
+import importlib.util
+
+import numpy as np
+import pandas as pd
+
+from answer_key import AnswerKey
+
+# Verbatims become Arrow strings when pyarrow is installed, else stay object
+TEXT_DTYPE = "string[pyarrow]" if importlib.util.find_spec("pyarrow") else None
+
+FLAG_VALUES = {0, 1}
+# A coded text column becomes categorical only when its values repeat
+MAX_CATEGORY_SHARE = 0.5
+
+
+def coded_columns(answer_key: AnswerKey, schema) -> set:
+    """Raw columns holding Answer key codes: 'Qx', 'Qx_n', 'Qx: option' and 'Qx | brand' columns."""
+    cols = set()
+    for qid in answer_key.question_ids():
+        if answer_key.options(qid):
+            cols.update(schema.question_columns(qid))
+            cols.update(schema.columns(qid, ":", " |"))
+    return cols
+
+
+def _integer_dtype(low, high, nullable: bool) -> str:
+    for bits in (8, 16, 32):
+        info = np.iinfo(f"int{bits}")
+        if info.min <= low and high <= info.max:
+            return f"Int{bits}" if nullable else f"int{bits}"
+    return "Int64" if nullable else "int64"
+
+
+def column_dtype(series: pd.Series, coded: bool):
+    """
+    Target dtype for one column, or None to leave it as is:
+      0/1 flags             → uint8 (UInt8 when blanks)
+      other whole numbers   → smallest int8/16/32 (nullable Int* when blanks)
+      repeating coded text  → category
+      other text            → Arrow string
+    Numbers in object columns (Qualtrics columns under the text row) count as
+    numbers; non-integer ones become float64.
+    """
+    if not (pd.api.types.is_numeric_dtype(series) or series.dtype == object):
+        return None
+    if pd.api.types.is_bool_dtype(series):
+        return None
+
+    present = series.notna()
+    n_present = int(present.sum())
+    if n_present == 0:
+        return None
+
+    numeric = series if pd.api.types.is_numeric_dtype(series) else pd.to_numeric(series, errors="coerce")
+    if int(numeric.notna().sum()) == n_present:
+        values = numeric[present].to_numpy(dtype=np.float64)
+        if not np.all(np.isfinite(values)) or not np.all(values == np.floor(values)):
+            return "float64" if series.dtype == object else None
+        nullable = n_present < len(series)
+        if set(np.unique(values)) <= FLAG_VALUES:
+            return "UInt8" if nullable else "uint8"
+        return _integer_dtype(values.min(), values.max(), nullable)
+
+    if series.dtype != object or not series[present].map(type).eq(str).all():
+        return None
+    if coded and series.nunique() <= n_present * MAX_CATEGORY_SHARE:
+        return "category"
+    return TEXT_DTYPE
+
+
+def plan_dtypes(df: pd.DataFrame, coded: set) -> dict:
+    """{column: target dtype} for every column that has a more compact representation."""
+    plan = {}
+    for col in df.columns:
+        dtype = column_dtype(df[col], col in coded)
+        if dtype is not None and str(df[col].dtype) != dtype:
+            plan[col] = dtype
+    return plan
+
+
+def apply_dtypes(df: pd.DataFrame, plan: dict) -> pd.DataFrame:
+    if not plan or df.columns.has_duplicates:
+        return df
+    converted = {}
+    for col, dtype in plan.items():
+        series = df[col]
+        if dtype not in ("category", TEXT_DTYPE) and series.dtype == object:
+            series = pd.to_numeric(series, errors="coerce")
+        converted[col] = series.astype(dtype)
+    return pd.DataFrame({col: converted.get(col, df[col]) for col in df.columns}, index=df.index)
+
+
+def compact_frame(df: pd.DataFrame, answer_key: AnswerKey, schema) -> pd.DataFrame:
+    return apply_dtypes(df, plan_dtypes(df, coded_columns(answer_key, schema)))
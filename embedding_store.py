@@ -0,0 +1,130 @@
+import hashlib
+import os
+import re
+import threading
+import uuid
+
+import numpy as np
+
+EMBEDDING_CACHE_DIR = os.path.join("cache", "embeddings")
+KEY_BYTES = 20  # SHA-1 digest
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def text_key(text: str, model: str) -> bytes:
+    """Content address of one document's embedding: SHA-1 of (model, text)."""
+    return hashlib.sha1(f"{model}\0{text}".encode("utf-8")).digest()
+
+
+class EmbeddingStore:
+    """
+    Content-addressed embedding vectors of one model, shared by every upload
+    and wave: a document whose text was embedded before (in any file) is
+    never sent to the embeddings API again.
+
+    On disk the store is a set of append-only shards under
+    cache/embeddings/<model>/, each a float32 `<id>.npy` matrix plus a
+    `<id>.keys` file with one 20-byte key per row. The keys file is written
+    last, so a shard interrupted halfway is ignored. Vectors are memory-mapped.
+    """
+
+    def __init__(self, model: str, root: str = EMBEDDING_CACHE_DIR):
+        self.model = model
+        self.path = os.path.join(root, re.sub(r"[^\w.-]+", "_", model))
+        self._rows = {}        # key → (shard id, row)
+        self._vectors = {}     # shard id → memory-mapped matrix
+        self._shards = set()
+        self._lock = threading.Lock()
+        self._load_shards()
+
+    def _load_shards(self):
+        """Index the shards not seen yet (other processes add shards too)."""
+        if not os.path.isdir(self.path):
+            return
+        for name in sorted(os.listdir(self.path)):
+            if name.endswith(".keys") and name[:-len(".keys")] not in self._shards:
+                self._add_shard(name[:-len(".keys")])
+
+    def _add_shard(self, shard):
+        self._shards.add(shard)
+        with open(os.path.join(self.path, shard + ".keys"), "rb") as f:
+            keys = f.read()
+        for row in range(len(keys) // KEY_BYTES):
+            self._rows.setdefault(keys[row * KEY_BYTES:(row + 1) * KEY_BYTES], (shard, row))
+
+    def _shard_vectors(self, shard):
+        vectors = self._vectors.get(shard)
+        if vectors is None:
+            vectors = self._vectors[shard] = np.load(os.path.join(self.path, shard + ".npy"), mmap_mode="r")
+        return vectors
+
+    def __len__(self):
+        return len(self._rows)
+
+    def lookup(self, texts):
+        """
+        (vectors, missing): a float32 matrix with a row per text — zeros where
+        the text isn't stored yet — and the positions of those missing texts.
+        The matrix is None when nothing is stored at all.
+        """
+        keys = [text_key(text, self.model) for text in texts]
+        with self._lock:
+            located = [self._rows.get(key) for key in keys]
+            if None in located:
+                self._load_shards()
+                located = [self._rows.get(key) for key in keys]
+            missing = [i for i, loc in enumerate(located) if loc is None]
+            if len(missing) == len(texts):
+                return None, missing
+
+            first = next(loc for loc in located if loc is not None)
+            dim = self._shard_vectors(first[0]).shape[1]
+            vectors = np.zeros((len(texts), dim), dtype=np.float32)
+            # One fancy-indexed read per shard rather than one per row
+            by_shard = {}
+            for i, loc in enumerate(located):
+                if loc is not None:
+                    by_shard.setdefault(loc[0], ([], []))
+                    by_shard[loc[0]][0].append(i)
+                    by_shard[loc[0]][1].append(loc[1])
+            for shard, (positions, rows) in by_shard.items():
+                vectors[positions] = self._shard_vectors(shard)[rows]
+        return vectors, missing
+
+    def add(self, texts, vectors):
+        """Store the vectors of `texts` (texts already stored are skipped) as a new shard."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        keys = [text_key(text, self.model) for text in texts]
+        with self._lock:
+            fresh, seen = [], set()
+            for i, key in enumerate(keys):
+                if key not in self._rows and key not in seen:
+                    fresh.append(i)
+                    seen.add(key)
+            if not fresh:
+                return 0
+
+            shard = uuid.uuid4().hex
+            try:
+                os.makedirs(self.path, exist_ok=True)
+                np.save(os.path.join(self.path, shard + ".npy"), vectors[fresh])
+                tmp = os.path.join(self.path, shard + ".keys.tmp")
+                with open(tmp, "wb") as f:
+                    f.write(b"".join(keys[i] for i in fresh))
+                os.replace(tmp, os.path.join(self.path, shard + ".keys"))
+            except OSError as e:
+                print("⚠️ Could not persist embeddings:", e)
+                return 0
+            self._add_shard(shard)
+        return len(fresh)
+
+
+def embedding_store(model: str) -> EmbeddingStore:
+    """The process-wide store of `model` (its shard index is read once)."""
+    with _stores_lock:
+        store = _stores.get(model)
+        if store is None:
+            store = _stores[model] = EmbeddingStore(model)
+        return store
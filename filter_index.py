@@ -0,0 +1,110 @@
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from answer_key import AnswerKey, normalize_code
+
+MAX_CACHED_SELECTIONS = 32
+
+_indexes = weakref.WeakSet()
+
+
+def _reset_locks_after_fork():
+    # A forked worker only has the forking thread; a lock held by any other
+    # parent thread at fork time would otherwise stay locked forever
+    for index in list(_indexes):
+        index._lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_locks_after_fork)
+
+
+def question_columns(df: pd.DataFrame, qid: str) -> list:
+    """The column holding `qid`, or its Qualtrics-style `qid_*` sub-columns."""
+    if qid in df.columns:
+        return [qid]
+    return [col for col in df.columns if isinstance(col, str) and col.startswith(qid + "_")]
+
+
+class FilterIndex:
+    """
+    Precomputed row bitsets for every (question, answer code) in the Answer key.
+
+    Each bitset is a packed NumPy bool array (1 bit per respondent), so a
+    combination of sidebar filters is a handful of bitwise ANDs. For questions
+    spread over several sub-columns a row matches if ANY sub-column has the code.
+    """
+
+    def __init__(self, df: pd.DataFrame, answer_key: AnswerKey, schema=None):
+        self.answer_key = answer_key
+        self.n_rows = len(df)
+        self._bitsets = {}
+        self._selections = OrderedDict()
+        self._lock = threading.Lock()
+        _indexes.add(self)
+
+        for qid in answer_key.question_ids():
+            options = answer_key.options(qid)
+            if not options:
+                continue
+            if schema:
+                # A column-projected dataset (load_projected) only indexes the columns it read
+                cols = [col for col in schema.question_columns(qid) if col in df.columns]
+            else:
+                cols = question_columns(df, qid)
+            if not cols:
+                continue
+
+            targets = {normalize_code(code) for code, _ in options}
+            masks = {target: np.zeros(self.n_rows, dtype=bool) for target in targets}
+            for col in cols:
+                # One factorize per column; codes are compared as small ints from here on
+                codes, uniques = pd.factorize(df[col])
+                for i, value in enumerate(uniques):
+                    target = normalize_code(value)
+                    if target in masks:
+                        masks[target] |= codes == i
+
+            for target, mask in masks.items():
+                self._bitsets[(qid, target)] = np.packbits(mask)
+
+    def bitset(self, qid, code):
+        """Packed bitset of rows answering `code` to `qid`, or None if not indexed."""
+        return self._bitsets.get((qid, normalize_code(code)))
+
+    def mask(self, bits) -> np.ndarray:
+        return np.unpackbits(bits, count=self.n_rows).astype(bool)
+
+    def select(self, filters: dict):
+        """
+        Row positions matching every global filter, or None when no filter
+        applies (the caller should then use all rows).
+        """
+        pairs = tuple(zip(filters.get("filter_questions", []), filters.get("filter_values", [])))
+        with self._lock:
+            if pairs in self._selections:
+                self._selections.move_to_end(pairs)
+                return self._selections[pairs]
+
+        combined = None
+        for q, v in pairs:
+            code = self.answer_key.code_for(q, v)
+            if code is None:
+                continue
+            bits = self.bitset(q, code)
+            if bits is None:
+                continue
+            combined = bits if combined is None else np.bitwise_and(combined, bits)
+
+        rows = None if combined is None else np.flatnonzero(self.mask(combined))
+
+        with self._lock:
+            self._selections[pairs] = rows
+            while len(self._selections) > MAX_CACHED_SELECTIONS:
+                self._selections.popitem(last=False)
+        return rows
@@ -0,0 +1,114 @@
+import csv
+import os
+
+import pandas as pd
+
+from xlsx_reader import open_workbook
+
+# Flat uploads hold one data table; the Answer key (and for Qualtrics the
+# Variable information) are uploaded as companion files and saved next to it
+# as '<name>.answer_key.<ext>' / '<name>.variable_information.<ext>'.
+DELIMITERS = {".csv": ",", ".tsv": "\t", ".txt": "\t"}
+FLAT_EXTENSIONS = set(DELIMITERS) | {".parquet"}
+COMPANION_EXTENSIONS = set(DELIMITERS) | {".xlsx", ".xls"}
+COMPANIONS = {
+    "answer_key": "Answer key",
+    "variable_information": "Variable information",
+}
+# The single "sheet" a flat upload offers in the sheet dropdown / cache keys
+FLAT_FILE_SHEET = "Raw data"
+# Delimited files are parsed this many rows at a time, so the parser's
+# buffers stay bounded whatever the size of the wave
+CHUNK_ROWS = 50_000
+# Third header row of a Qualtrics CSV export
+QUALTRICS_IMPORT_ID = '{"ImportId"'
+
+
+def is_flat_file(filepath: str) -> bool:
+    return os.path.splitext(filepath)[1].lower() in FLAT_EXTENSIONS
+
+
+def companion_path(filepath: str, kind: str, ext: str) -> str:
+    return f"{os.path.splitext(filepath)[0]}.{kind}{ext.lower()}"
+
+
+def find_companion(filepath: str, kind: str):
+    """The saved `kind` companion of a flat upload, or None."""
+    for ext in sorted(COMPANION_EXTENSIONS):
+        path = companion_path(filepath, kind, ext)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def source_files(filepath: str) -> list:
+    """The upload plus its companion files — everything a dataset is parsed from."""
+    if not is_flat_file(filepath):
+        return [filepath]
+    companions = [find_companion(filepath, kind) for kind in COMPANIONS]
+    return [filepath] + [path for path in companions if path]
+
+
+def _header_rows(filepath: str, n: int = 3) -> list:
+    sep = DELIMITERS.get(os.path.splitext(filepath)[1].lower())
+    if sep is None:
+        return []
+    with open(filepath, newline="", encoding="utf-8-sig", errors="replace") as f:
+        reader = csv.reader(f, delimiter=sep)
+        return [row for _, row in zip(range(n), reader)]
+
+
+def _has_import_row(filepath: str) -> bool:
+    rows = _header_rows(filepath)
+    return len(rows) == 3 and any(cell.startswith(QUALTRICS_IMPORT_ID) for cell in rows[2])
+
+
+def is_qualtrics_export(filepath: str) -> bool:
+    """Qualtrics layout: the ImportId header row, or a Variable information companion."""
+    return _has_import_row(filepath) or find_companion(filepath, "variable_information") is not None
+
+
+def read_delimited(filepath: str, header=0, skiprows=None, skip_blank_lines=True) -> pd.DataFrame:
+    """CSV/TSV parsed in CHUNK_ROWS chunks and concatenated."""
+    sep = DELIMITERS[os.path.splitext(filepath)[1].lower()]
+    chunks = pd.read_csv(
+        filepath, sep=sep, header=header, skiprows=skiprows, encoding="utf-8-sig",
+        skip_blank_lines=skip_blank_lines, chunksize=CHUNK_ROWS, low_memory=False
+    )
+    return pd.concat(chunks, ignore_index=True)
+
+
+def read_companion(filepath: str, kind: str):
+    """
+    The `kind` companion as read with header=None (like the workbook sheet it
+    replaces), or None when it wasn't uploaded. Workbooks are read from the
+    sheet of the same name, else their first sheet.
+    """
+    path = find_companion(filepath, kind)
+    if path is None:
+        return None
+    if os.path.splitext(path)[1] in DELIMITERS:
+        # Blank rows separate the InQuery Answer key blocks
+        return read_delimited(path, header=None, skip_blank_lines=False)
+    with open_workbook(path) as xls:
+        sheet = COMPANIONS[kind] if COMPANIONS[kind] in xls.sheet_names else 0
+        return xls.parse(sheet, header=None)
+
+
+def read_flat_upload(filepath: str, data_format: str = "inquery"):
+    """
+    (raw_df, key_df, varinfo_df) of a CSV/TSV/Parquet upload, in the shape the
+    workbook sheets are parsed to: column codes as the header and, for
+    Qualtrics, the question-text row as the first data row (a CSV export's
+    ImportId row is dropped).
+    """
+    key_df = read_companion(filepath, "answer_key")
+    if key_df is None:
+        raise ValueError(f"No Answer key file was uploaded with {os.path.basename(filepath)}")
+    varinfo_df = read_companion(filepath, "variable_information") if data_format == "qualtrics" else None
+
+    if os.path.splitext(filepath)[1].lower() == ".parquet":
+        raw_df = pd.read_parquet(filepath)
+    else:
+        raw_df = read_delimited(filepath, skiprows=[2] if _has_import_row(filepath) else None)
+    return raw_df, key_df, varinfo_df
@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from dataset import load_dataset
+
+MAX_INGEST_JOBS = 32
+
+# Stages in the order a job runs them; "rag" only when the RAG index is prebuilt
+STAGES = ["parse", "index", "rag"]
+
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+
+
+def _reset_lock_after_fork():
+    global _jobs_lock
+    _jobs_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_lock_after_fork)
+
+
+def prebuild_rag_enabled() -> bool:
+    """INGEST_PREBUILD_RAG=1 embeds the upload at ingest time (read per call so .env changes apply)."""
+    return os.getenv("INGEST_PREBUILD_RAG", "0").strip().lower() in ("1", "true", "yes")
+
+
+class IngestJob:
+    """
+    Background preparation of one upload: parse the sheet (or read its
+    sidecar), build the Answer key index / schema catalog / filter bitsets,
+    and optionally embed the rows for the AI assistant. `status()` is what
+    /ingest_status reports.
+    """
+
+    def __init__(self, upload_folder, filename, sheet, data_format, build_rag=False):
+        self.upload_id = uuid.uuid4().hex
+        self.upload_folder = upload_folder
+        self.filename = filename
+        self.sheet = sheet
+        self.data_format = data_format
+        self.stages = [s for s in STAGES if build_rag or s != "rag"]
+        self.stage = "queued"
+        self.done = []
+        self.state = "queued"
+        self.error = None
+        self.started = None
+        self.finished = None
+
+    def _enter(self, stage):
+        if self.stage in self.stages and self.stage not in self.done:
+            self.done.append(self.stage)
+        self.stage = stage
+
+    def run(self):
+        self.state = "running"
+        self.started = time.time()
+        filepath = os.path.join(self.upload_folder, self.filename)
+        try:
+            self._enter("parse")
+            load_dataset(filepath, self.sheet, self.data_format, progress=self._enter)
+            if "rag" in self.stages:
+                self._enter("rag")
+                self._build_rag()
+            self.stage = "ready"
+            self.done = list(self.stages)
+            self.state = "ready"
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            print(f"⚠️ Ingestion of {self.filename} [{self.sheet}] failed:", e)
+        finally:
+            self.finished = time.time()
+
+    def _build_rag(self):
+        from routes.rag_chatbot import get_survey_rag
+
+        # Lands in the assistant cache, so /genai and /chat start warm
+        get_survey_rag(self.upload_folder, self.filename, self.sheet)
+
+    def status(self) -> dict:
+        elapsed = ((self.finished or time.time()) - self.started) if self.started else 0
+        return {
+            "upload_id": self.upload_id,
+            "filename": self.filename,
+            "sheet": self.sheet,
+            "data_format": self.data_format,
+            "state": self.state,
+            "stage": self.stage,
+            "stages": self.stages,
+            "completed": list(self.done),
+            "progress": round(len(self.done) / len(self.stages), 2),
+            "elapsed": round(elapsed, 2),
+            "error": self.error
+        }
+
+
+def start_ingest(upload_folder, filename, sheet, data_format="inquery", build_rag=None) -> IngestJob:
+    """Register an ingestion job and run it on a background thread."""
+    if build_rag is None:
+        build_rag = prebuild_rag_enabled()
+    job = IngestJob(upload_folder, filename, sheet, data_format, build_rag)
+    with _jobs_lock:
+        _jobs[job.upload_id] = job
+        while len(_jobs) > MAX_INGEST_JOBS:
+            _jobs.popitem(last=False)
+
+    thread = threading.Thread(target=job.run, name=f"ingest-{job.upload_id[:8]}", daemon=True)
+    thread.start()
+    return job
+
+
+def get_job(upload_id):
+    with _jobs_lock:
+        return _jobs.get(upload_id)
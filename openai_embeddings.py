@@ -0,0 +1,148 @@
+import importlib.util
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import openai
+from openai import OpenAI
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# API limits per request: 2048 inputs, 300k tokens in total, 8191 per input.
+# Batches are cut well inside them so one slow request doesn't hold up the rest.
+MAX_BATCH_INPUTS = 512
+MAX_BATCH_TOKENS = 100_000
+MAX_INPUT_TOKENS = 8191
+# Concurrent embedding requests, from the EMBED_CONCURRENCY env var (read per call)
+DEFAULT_CONCURRENCY = 4
+# Rate limits / timeouts / 5xx: exponential backoff with jitter, Retry-After honoured
+MAX_RETRIES = 6
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+RETRYABLE = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+# Without tiktoken, tokens are estimated from the length (English text ≈ 4 chars/token; 3 stays safe)
+CHARS_PER_TOKEN = 3
+
+_client = None
+_client_lock = threading.Lock()
+_encoding = None
+
+
+def _reset_after_fork():
+    # The pooled connections belong to the parent; a forked worker opens its own
+    global _client, _client_lock
+    _client = None
+    _client_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_client() -> OpenAI:
+    """
+    The process-wide OpenAI client: one HTTP connection pool shared by chat,
+    retrieval and embedding requests (OPENAI_BASE_URL points it at a stub server).
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        return _client
+
+
+def _concurrency() -> int:
+    try:
+        return max(1, int(os.getenv("EMBED_CONCURRENCY", DEFAULT_CONCURRENCY)))
+    except ValueError:
+        return DEFAULT_CONCURRENCY
+
+
+def _tokenizer():
+    global _encoding
+    if _encoding is None and importlib.util.find_spec("tiktoken"):
+        import tiktoken
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = _tokenizer()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _truncate(text: str) -> str:
+    """Cut an input over MAX_INPUT_TOKENS (the API would reject the whole batch)."""
+    encoding = _tokenizer()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return encoding.decode(tokens[:MAX_INPUT_TOKENS]) if len(tokens) > MAX_INPUT_TOKENS else text
+    return text[:MAX_INPUT_TOKENS * CHARS_PER_TOKEN]
+
+
+def token_batches(texts, max_inputs=MAX_BATCH_INPUTS, max_tokens=MAX_BATCH_TOKENS) -> list:
+    """Consecutive (start, end) ranges of `texts` within the per-request input and token budgets."""
+    batches, start, tokens = [], 0, 0
+    for i, text in enumerate(texts):
+        n = min(count_tokens(text), MAX_INPUT_TOKENS)
+        if i > start and (i - start >= max_inputs or tokens + n > max_tokens):
+            batches.append((start, i))
+            start, tokens = i, 0
+        tokens += n
+    if start < len(texts):
+        batches.append((start, len(texts)))
+    return batches
+
+
+def _retry_delay(error, attempt: int) -> float:
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        if retry_after is not None:
+            return min(float(retry_after), BACKOFF_MAX)
+    except ValueError:
+        pass
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def _embed_batch(texts, model):
+    client = get_client().with_options(max_retries=0)  # retries are ours, with backoff
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = client.embeddings.create(input=texts, model=model)
+            return [record.embedding for record in sorted(response.data, key=lambda r: r.index)]
+        except RETRYABLE as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = _retry_delay(e, attempt)
+            print(f"⚠️ Embedding request failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def embed_texts(texts, model=EMBEDDING_MODEL, concurrency=None) -> np.ndarray:
+    """
+    float32 matrix of the embeddings of `texts`, in order: token-aware
+    batches sent over the shared client, up to `concurrency` (default
+    EMBED_CONCURRENCY) in flight at once.
+    """
+    texts = [_truncate(text) for text in texts]
+    batches = token_batches(texts)
+    if not batches:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    def run(batch):
+        start, end = batch
+        return _embed_batch(texts[start:end], model)
+
+    workers = min(concurrency or _concurrency(), len(batches))
+    if workers <= 1:
+        results = [run(batch) for batch in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed") as pool:
+            results = list(pool.map(run, batches))
+    return np.asarray([vector for result in results for vector in result], dtype=np.float32)
@@ -0,0 +1,133 @@
+import math
+import re
+
+import pandas as pd
+
+from answer_key import AnswerKey
+
+PURE_QID = re.compile(r"^Q\d+$")
+QUALTRICS_SUB_COLUMN = re.compile(r"Q\d+_\d+")
+NPS_MARKER = re.compile(r"_NPS_", re.IGNORECASE)
+
+
+def _by_qid_number(qids):
+    return sorted(qids, key=lambda q: int(q[1:]))
+
+
+class ColumnProfile:
+    """Distinct non-null values of one column, raw and as numbers (computed once)."""
+
+    def __init__(self, series: pd.Series):
+        self.raw = pd.unique(series.dropna())
+        numeric = pd.to_numeric(pd.Series(self.raw, dtype=object), errors="coerce").dropna()
+        self.numeric = set(numeric.astype(float))
+
+
+class QuestionScan:
+    """
+    Every question-type recommendation for one dataset from a single pass over
+    the columns: columns are grouped by QID once, each column's distinct values
+    are profiled at most once, and all detectors read those profiles.
+
+    `by_type` holds the QIDs per type in the order the old per-type detectors
+    returned them; `types_for(qid)` gives the recommendation list for one QID.
+    """
+
+    def __init__(self, df: pd.DataFrame, answer_key: AnswerKey, data_format: str = "inquery"):
+        self._df = df
+        self._profiles = {}
+        if data_format == "qualtrics":
+            self.by_type = self._scan_qualtrics(df.columns)
+        else:
+            self.by_type = self._scan_inquery(df.columns, answer_key)
+        self._df = None  # profiles are all we need from here on
+
+        self._types = {}
+        for q_type in ("nps", "single_choice", "multi_select", "matrix"):
+            for qid in self.by_type.get(q_type, []):
+                self._types.setdefault(qid, []).append(q_type)
+
+    def _profile(self, col) -> ColumnProfile:
+        if col not in self._profiles:
+            self._profiles[col] = ColumnProfile(self._df[col])
+        return self._profiles[col]
+
+    def types_for(self, qid) -> list:
+        return list(self._types.get(qid, []))
+
+    def recommendations(self, qids) -> dict:
+        return {qid: self.types_for(qid) for qid in qids}
+
+    def _scan_inquery(self, columns, answer_key):
+        pipe_groups, colon_groups, pure = {}, {}, []
+        for col in columns:
+            if not isinstance(col, str) or ":: user input" in col.lower():
+                continue
+            if "|" in col:
+                pipe_groups.setdefault(col.split("|")[0].strip(), []).append(col)
+            if ":" in col:
+                colon_groups.setdefault(col.split(":")[0].strip(), []).append(col)
+            if PURE_QID.match(col):
+                pure.append(col)
+
+        # NPS: 'Qx | Brand' battery whose answer-key labels are all 0–10
+        nps = []
+        for qid in pipe_groups:
+            numeric_vals = []
+            for label in answer_key.labels(qid):
+                try:
+                    numeric_vals.append(int(str(label).strip()))
+                except ValueError:
+                    pass
+            if numeric_vals and all(0 <= v <= 10 for v in numeric_vals):
+                nps.append(qid)
+
+        # Single choice: plain 'Qx' column using at least one numeric answer-key code
+        single = []
+        for col in pure:
+            valid_codes = {code for code, _ in answer_key.options(col) if isinstance(code, int)}
+            used = {int(v) for v in self._profile(col).numeric if math.isfinite(v)}
+            if used and valid_codes & used:
+                single.append(col)
+
+        # Multi-select: 'Qx: option' group with only 0 / 1 values
+        multi = []
+        for qid, cols in colon_groups.items():
+            if len(cols) >= 2 and all(all(v in [0, 1] for v in self._profile(c).raw) for c in cols):
+                multi.append(qid)
+
+        return {"nps": nps, "single_choice": single, "multi_select": multi}
+
+    def _scan_qualtrics(self, columns):
+        nps, nps_prefixed, pure, groups = set(), set(), set(), {}
+        for col in columns:
+            if not isinstance(col, str):
+                continue
+            if NPS_MARKER.search(col):
+                m = re.search(r"(Q\d+)", col, re.IGNORECASE)
+                if m:
+                    nps.add(m.group(1).upper())
+                m = re.match(r"(Q\d+)", col, re.IGNORECASE)
+                if m:
+                    nps_prefixed.add(m.group(1).upper())
+            if re.fullmatch(r"Q\d+", col):
+                pure.add(col)
+            if QUALTRICS_SUB_COLUMN.fullmatch(col):
+                groups.setdefault(col.split("_")[0], []).append(col)
+
+        multi, matrix = [], []
+        for base, cols in groups.items():
+            if len(cols) < 2:
+                continue
+            values = set().union(*(self._profile(c).numeric for c in cols))
+            if values.issubset({0, 1}):
+                multi.append(base)
+            elif min(values) >= 0 and max(values) <= 10 and len(values) > 2:
+                matrix.append(base)
+
+        return {
+            "nps": sorted(nps),
+            "single_choice": _by_qid_number(pure - nps_prefixed),
+            "multi_select": _by_qid_number(multi),
+            "matrix": _by_qid_number(matrix)
+        }
@@ -0,0 +1,107 @@
+import os
+import re
+import shutil
+import uuid
+
+import faiss
+import numpy as np
+
+RAG_CACHE_DIR = os.path.join("cache", "rag")
+# Bump when convert_to_documents changes what a document looks like
+SNAPSHOT_VERSION = 1
+# Zero-copy mapping of the index vectors where faiss supports it
+MMAP_FLAG = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+
+
+class DocumentFile:
+    """
+    Read-only list of documents backed by an offset-indexed file: the UTF-8
+    texts back to back in `documents.bin` and n+1 uint64 offsets in
+    `documents.idx`. Both are memory-mapped; a document is decoded when
+    indexed, so opening costs nothing whatever the corpus size.
+    """
+
+    def __init__(self, path):
+        self._offsets = np.load(os.path.join(path, "documents.idx.npy"), mmap_mode="r")
+        size = int(self._offsets[-1])
+        self._data = np.memmap(os.path.join(path, "documents.bin"), dtype=np.uint8, mode="r") if size else b""
+        self.nbytes = size + self._offsets.nbytes
+
+    @staticmethod
+    def write(path, documents):
+        encoded = [doc.encode("utf-8") for doc in documents]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+        np.cumsum([len(doc) for doc in encoded], out=offsets[1:])
+        with open(os.path.join(path, "documents.bin"), "wb") as f:
+            for doc in encoded:
+                f.write(doc)
+        np.save(os.path.join(path, "documents.idx.npy"), offsets)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("document index out of range")
+        return bytes(self._data[int(self._offsets[i]):int(self._offsets[i + 1])]).decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+def snapshot_path(digest: str, sheet: str, model: str) -> str:
+    safe = re.sub(r"\W+", "_", f"{sheet}_{model}").strip("_")
+    return os.path.join(RAG_CACHE_DIR, f"{digest[:20]}_{safe}_v{SNAPSHOT_VERSION}")
+
+
+def save_snapshot(path, documents, embeddings, index):
+    """
+    Write documents, the float32 embedding matrix (.npy) and the FAISS index
+    to a temporary directory renamed into place, so readers never see a
+    half-written snapshot.
+    """
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.makedirs(tmp)
+        DocumentFile.write(tmp, documents)
+        np.save(os.path.join(tmp, "embeddings.npy"), np.asarray(embeddings, dtype=np.float32))
+        faiss.write_index(index, os.path.join(tmp, "index.faiss"))
+        os.replace(tmp, path)
+    except OSError as e:
+        if not os.path.isdir(path):
+            print("⚠️ Could not persist RAG snapshot:", e)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def replace_index(path, index):
+    """Swap in a rebuilt index; readers that mapped the old file keep their view."""
+    tmp = os.path.join(path, f"index.{uuid.uuid4().hex}.tmp")
+    try:
+        faiss.write_index(index, tmp)
+        os.replace(tmp, os.path.join(path, "index.faiss"))
+    except (OSError, RuntimeError) as e:
+        print("⚠️ Could not persist RAG index:", e)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def load_snapshot(path):
+    """(documents, embeddings, index), all memory-mapped, or None when there is no snapshot."""
+    if not os.path.exists(os.path.join(path, "index.faiss")):
+        return None
+    try:
+        documents = DocumentFile(path)
+        embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+        try:
+            index = faiss.read_index(os.path.join(path, "index.faiss"), MMAP_FLAG)
+        except RuntimeError:
+            index = faiss.read_index(os.path.join(path, "index.faiss"))
+    except (OSError, ValueError) as e:
+        print("⚠️ Could not read RAG snapshot:", e)
+        return None
+    return documents, embeddings, index
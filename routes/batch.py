@@ -0,0 +1,284 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack, contextmanager
+from copy import deepcopy
+import multiprocessing as mp
+import os
+import uuid
+from flask import current_app, has_request_context, request
+
+from dataset import load_dataset, pinned_dataset
+from utils import select_rows
+from routes.single_choice import process_single_choice, process_single_choice_qualtrics, get_single_choice_data
+from routes.matrix_question import process_matrix_question, process_matrix_question_qualtrics, get_matrix_question_data
+from routes.multiple_select import process_multi_select, process_multi_select_qualtrics, get_multi_select_data
+from routes.cross_cut import process_cross_cut, process_cross_cut_qualtrics, get_cross_cut_data, get_cross_cut_data_qualtrics
+from routes.rank_based import process_ranked_question, process_ranked_question_qualtrics, get_ranked_data
+from routes.nps_question import process_nps_question, process_nps_question_qualtrics, get_nps_data
+from routes.share_of_wallet import process_share_of_wallet, get_sow_data
+
+# Worker processes for large tab runs come from the TAB_WORKERS env var
+# (read per call, so .env works): 1 = sequential (default), 0 = one per CPU
+DEFAULT_TAB_WORKERS = 1
+# Below this many (question, type) jobs forking isn't worth it
+PARALLEL_MIN_JOBS = 4
+
+# (data_format, question type) → processor(filepath, sheet, column, filters)
+PROCESSORS = {
+    "inquery": {
+        "cross_cut": process_cross_cut,
+        "single_choice": process_single_choice,
+        "matrix": process_matrix_question,
+        "multi_select": process_multi_select,
+        "ranked": process_ranked_question,
+        "nps": process_nps_question,
+        "sow": process_share_of_wallet
+    },
+    "qualtrics": {
+        "cross_cut": process_cross_cut_qualtrics,
+        "single_choice": process_single_choice_qualtrics,
+        "matrix": process_matrix_question_qualtrics,
+        "multi_select": process_multi_select_qualtrics,
+        "ranked": process_ranked_question_qualtrics,
+        "nps": process_nps_question_qualtrics,
+        "sow": process_share_of_wallet
+    }
+}
+
+# Excel export: (data_format, question type) → data function returning a dict
+DATA_FUNCTIONS = {
+    "inquery": {
+        "single_choice": get_single_choice_data,
+        "multi_select": get_multi_select_data,
+        "matrix": get_matrix_question_data,
+        "ranked": get_ranked_data,
+        "cross_cut": get_cross_cut_data,
+        "nps": get_nps_data,
+        "sow": get_sow_data
+    }
+}
+DATA_FUNCTIONS["qualtrics"] = dict(DATA_FUNCTIONS["inquery"], cross_cut=get_cross_cut_data_qualtrics)
+
+# Per-batch context, set by the parent right before forking and read by the workers
+# (inherited copy-on-write, so the Flask app and the parsed datasets are never pickled).
+# Keyed by a batch token so concurrent requests don't see each other's context.
+_job_contexts = {}
+
+def worker_count(n_jobs, workers=None):
+    if workers is None:
+        try:
+            workers = int(os.getenv("TAB_WORKERS", DEFAULT_TAB_WORKERS))
+        except ValueError:
+            workers = DEFAULT_TAB_WORKERS
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    if n_jobs < PARALLEL_MIN_JOBS or "fork" not in mp.get_all_start_methods():
+        return 1
+    return max(1, min(workers, n_jobs))
+
+def run_jobs(fn, jobs, workers=None):
+    """
+    [fn(*job) for job in jobs], in job order. Large batches fan out to a
+    forked process pool: workers inherit the already-parsed datasets from the
+    parent instead of receiving pickled frames; only the job tuples and the
+    results cross the process boundary.
+    """
+    n_workers = worker_count(len(jobs), workers)
+    if n_workers <= 1:
+        return [fn(*job) for job in jobs]
+
+    chunksize = max(1, len(jobs) // (n_workers * 4))
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=mp.get_context("fork")) as pool:
+            return list(pool.map(fn, *zip(*jobs), chunksize=chunksize))
+    except BrokenProcessPool as e:
+        print("⚠️ Worker pool failed, running sequentially:", e)
+        return [fn(*job) for job in jobs]
+
+@contextmanager
+def job_context(**context):
+    """Register a batch context for the duration of the block; yields its token."""
+    token = uuid.uuid4().hex
+    _job_contexts[token] = dict(context, parent_pid=os.getpid())
+    try:
+        yield token
+    finally:
+        _job_contexts.pop(token, None)
+
+def job_qids(jobs, base_filters=None):
+    """Every QID a batch reads: the questions, their cut / segment columns and the global filter questions."""
+    qids = list((base_filters or {}).get('filter_questions', []))
+    for q, _, filters in jobs:
+        qids += [q, filters.get('cut_column', ''), filters.get('segment_column', '')]
+        qids += list(filters.get('filter_questions', []))
+    return list(dict.fromkeys(qid for qid in qids if qid))
+
+def render_formats(data_format, jobs):
+    """
+    Data formats render_questions loads: the batch's own, plus InQuery for a
+    Qualtrics batch with SOW jobs (process_share_of_wallet reads that layout).
+    """
+    if data_format == "qualtrics" and any(q_type == 'sow' for _, q_type, _ in jobs):
+        return ["inquery", data_format]
+    return [data_format]
+
+@contextmanager
+def pinned_datasets(filepath, sheet, data_formats, qids):
+    """Pin the column-projected dataset of each data format (see dataset.load_projected)."""
+    with ExitStack() as stack:
+        yield [stack.enter_context(pinned_dataset(filepath, sheet, fmt, qids)) for fmt in data_formats]
+
+@contextmanager
+def worker_datasets(ctx):
+    """
+    In a forked worker, re-pin the batch's datasets: a memo hit on the
+    projections inherited from the parent, so a processor's load_dataset()
+    never falls through to a full load.
+    """
+    if ctx["parent_pid"] == os.getpid():
+        yield
+        return
+    with pinned_datasets(ctx["filepath"], ctx["sheet"], ctx["data_formats"], ctx["qids"]):
+        yield
+
+def get_question_text_from_key(answer_key, qid):
+    return answer_key.question_text(qid, qid)
+
+def get_question_text_from_raw(schema, qid: str) -> str:
+    """
+    Return the human-readable text for question `qid` from the Qualtrics
+    question-text row (the row right under the Q-code header), as recorded in
+    the dataset's schema catalog.
+    """
+    # 1) 'Q2', 'Q2_1', 'Q2:1', … columns of this qid, straight from the catalog
+    cols = schema.numbered_columns(qid)
+    if not cols:
+        return qid  # no match → give back the qid itself
+
+    # 2) Pull their texts from the header row
+    texts = [schema.header_text(c) for c in cols]
+
+    # 4) If only one column, that's the text
+    if len(texts) == 1:
+        return texts[0]
+
+    # 5) If multiple (e.g. multi-select), return the common prefix before ' - '
+    prefixes = [t.split(' - ')[0] for t in texts]
+    if len(set(prefixes)) == 1:
+        return prefixes[0]
+
+    # 6) Otherwise fall back to the longest common prefix of all full texts
+    shortest, longest = min(texts), max(texts)
+    for i, ch in enumerate(shortest):
+        if ch != longest[i]:
+            return shortest[:i].rstrip()
+    return shortest.rstrip()
+
+def build_jobs(form, questions, base_filters):
+    """
+    One (question, type, filters) job per ticked type, with the per-question
+    options (cut column, segment column, max rank, SOW buckets) from the submitted form.
+    """
+    jobs = []
+    for q in questions:
+        types = list(dict.fromkeys(form.getlist(f"type_{q}")))
+        for q_type in types:
+            filters = deepcopy(base_filters)
+            # The cut dropdown is always posted; it only applies once Cross Cut is ticked
+            filters['cut_column'] = form.get(f'cut_column_{q}', '') if 'cross_cut' in types else ''
+            # NPS / ranked / SOW segments come from their own dropdown, empty unless chosen
+            filters['segment_column'] = form.get(f'segment_column_{q}', '')
+            filters['max_rank'] = form.get(f'max_rank_{q}', '')
+            filters['sow_buckets'] = form.get(f'sow_buckets_{q}', '')
+            jobs.append((q, q_type, filters))
+    return jobs
+
+def _question_text(ds, q, q_type, filters, data_format):
+    if q_type == 'cross_cut':
+        return f"Cross cut {q} x {filters['cut_column']} - Cross Cut Summary"
+    if data_format == "qualtrics" and q_type != 'sow':
+        return get_question_text_from_raw(ds.schema, q)
+    return get_question_text_from_key(ds.answer_key, q)
+
+def _render_one(filepath, sheet, data_format, q, q_type, filters):
+    processors = PROCESSORS.get(data_format, PROCESSORS["inquery"])
+    try:
+        processor = processors.get(q_type)
+        if processor is None or (q_type == 'cross_cut' and not filters['cut_column']):
+            html = f"<p>Unsupported or incomplete type for {q}</p>"
+            question_text = f"{q} - {q_type}"
+        else:
+            html = processor(filepath, sheet, q, filters)
+            question_text = _question_text(load_dataset(filepath, sheet, data_format), q, q_type, filters, data_format)
+        return {'question': q, 'text': question_text, 'html': html}, True
+
+    except Exception as e:
+        return {
+            'question': q,
+            'text': f"{q} - {q_type}",
+            'html': f"<p>Error processing {q} ({q_type}): {str(e)}</p>"
+        }, False
+
+def _render_job(token, q, q_type, filters):
+    ctx = _job_contexts[token]
+    args = (ctx["filepath"], ctx["sheet"], ctx["data_format"], q, q_type, filters)
+    with worker_datasets(ctx):
+        if ctx["parent_pid"] != os.getpid():
+            # Templates need a request context (url_for) that doesn't survive the fork
+            with ctx["app"].test_request_context(base_url=ctx["base_url"]):
+                return _render_one(*args)
+        return _render_one(*args)
+
+def render_questions(filepath, sheet, data_format, jobs, base_filters, workers=None):
+    """
+    Render every (question, type, filters) job against one loaded dataset and
+    one global-filter selection, in parallel for large batches (see run_jobs).
+    Returns (results, all_columns) the way display_multi_results.html expects them.
+    Only the columns of the questions, cuts and filters in the batch are loaded.
+    """
+    qids = job_qids(jobs, base_filters)
+    data_formats = render_formats(data_format, jobs)
+    with pinned_datasets(filepath, sheet, data_formats, qids) as datasets:
+        ds = datasets[data_formats.index(data_format)]
+        # Global filters are resolved once here; every processor's own
+        # select_rows() call is then a memo hit on the same FilterIndex
+        select_rows(ds, base_filters)
+
+        with job_context(
+            app=current_app._get_current_object(),
+            base_url=request.url_root if has_request_context() else "http://localhost/",
+            filepath=filepath, sheet=sheet, data_format=data_format,
+            data_formats=data_formats, qids=qids
+        ) as token:
+            rendered = run_jobs(_render_job, [(token,) + tuple(job) for job in jobs], workers)
+
+    results = [result for result, _ in rendered]
+    all_columns = [result['question'] for result, ok in rendered if ok]
+    results.sort(key=lambda r: int(r['question'][1:]) if r['question'].startswith('Q') else 999)
+    return results, all_columns
+
+def _data_job(token, q, q_type, filters):
+    ctx = _job_contexts[token]
+    data_function = DATA_FUNCTIONS.get(ctx["data_format"], DATA_FUNCTIONS["inquery"]).get(q_type)
+    if data_function is None:
+        return None, None
+    try:
+        with worker_datasets(ctx):
+            return data_function(ctx["filepath"], ctx["sheet"], q, filters), None
+    except Exception as e:
+        return None, str(e)
+
+def compute_outputs(filepath, sheet, data_format, jobs, workers=None):
+    """
+    (output dict, error message) per (question, type, filters) job, in job
+    order, for the Excel export. Output is None for unsupported types.
+    """
+    # Load up front (only the columns the jobs read) so forked workers inherit
+    # the datasets instead of re-reading them; SOW reads the InQuery layout
+    data_formats = ["inquery"] + (["qualtrics"] if data_format == "qualtrics" else [])
+    qids = job_qids(jobs)
+    with pinned_datasets(filepath, sheet, data_formats, qids), job_context(
+        filepath=filepath, sheet=sheet, data_format=data_format,
+        data_formats=data_formats, qids=qids
+    ) as token:
+        return run_jobs(_data_job, [(token,) + tuple(job) for job in jobs], workers)
@@ -1,61 +1,70 @@
 from flask import render_template
 import pandas as pd
+import numpy as np
 import re
-from utils import apply_global_filters
+from utils import select_rows
+from dataset import load_dataset
+from tabulation import column_values, code_matrix, score_histogram, percent_of
 import os
 
+BOX_SIZE = 2
+
+def scale_summary(counts, codes, col_totals, box_size=BOX_SIZE):
+    """
+    Top-box / bottom-box % (the last / first `box_size` scale points in answer-key
+    order) and mean score per statement, all from the [codes × statements] counts.
+    The mean only uses numeric codes.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    box_size = min(box_size, len(codes))
+    top = percent_of(counts[len(codes) - box_size:].sum(axis=0), col_totals) if box_size else np.zeros(counts.shape[1])
+    bottom = percent_of(counts[:box_size].sum(axis=0), col_totals) if box_size else np.zeros(counts.shape[1])
+
+    numeric = pd.to_numeric(pd.Series(codes, dtype=object), errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+    scored = ~np.isnan(numeric)
+    n_scored = counts[scored].sum(axis=0)
+    weighted = (numeric[scored][:, None] * counts[scored]).sum(axis=0)
+    mean = np.where(n_scored > 0, weighted / np.where(n_scored > 0, n_scored, 1), 0.0)
+    return {
+        "top_box": top.tolist(),
+        "bottom_box": bottom.tolist(),
+        "mean_scores": np.round(mean, 2).tolist()
+    }
+
+def tabulate_battery(df, relevant_cols, codes, rows=None):
+    """Code × statement counts (one bincount), % of answering respondents, column totals."""
+    code_idx = code_matrix(df, relevant_cols, codes, rows)
+    counts = score_histogram(code_idx, len(codes))[0]
+    col_totals = np.array([int(pd.notna(column_values(df, col, rows)).sum()) for col in relevant_cols], dtype=np.int64)
+    return counts, percent_of(counts, col_totals), col_totals
+
 def get_matrix_question_data(filepath, sheet, column, filters):
-    df = pd.read_excel(filepath, sheet_name=sheet, header=2)
-    df_key = pd.read_excel(filepath, sheet_name="Answer key", header=None)
-    df = apply_global_filters(df, df_key, filters)
+    ds = load_dataset(filepath, sheet)
+    answer_key = ds.answer_key
+    df = ds.df
+    rows = select_rows(ds, filters)
     base_prefix = re.split(r"[:|]", column)[0].strip()
 
-    relevant_cols = [
-        col for col in df.columns
-        if isinstance(col, str)
-        and (col.startswith(f"{base_prefix}:") or col.startswith(f"{base_prefix} |"))
-    ]
+    relevant_cols = ds.schema.columns(base_prefix, ":", " |")
 
     # Build row label map
-    option_map = {}
-    capture = False
-    for _, row in df_key.iterrows():
-        if pd.notna(row[0]) and str(row[0]).strip() == base_prefix:
-            capture = True
-            continue
-        if capture and pd.isna(row[0]):
-            break
-        if capture and pd.notna(row[0]) and pd.notna(row[1]):
-            option_map[str(int(float(row[0]))) if str(row[0]).replace('.', '', 1).isdigit() else str(row[0]).strip()] = str(row[1]).strip()
+    option_map = {str(code): label for code, label in answer_key.options(base_prefix)}
 
     row_labels = list(option_map.values())
-    col_labels = [col.split(":")[1].strip() for col in relevant_cols]
-    col_totals = [df[col].notna().sum() for col in relevant_cols]
-
-    count_matrix = []
-    percent_matrix = []
-    for code, label in option_map.items():
-        row_counts = []
-        row_percents = []
-        for i, col in enumerate(relevant_cols):
-            count = (df[col].dropna().astype(str).str.strip() == code).sum()
-            row_counts.append(count)
-            percent = (count / col_totals[i]) * 100 if col_totals[i] else 0
-            row_percents.append(percent)
-        count_matrix.append(row_counts)
-        percent_matrix.append(row_percents)
+    col_labels = [ds.schema.sub_label(col) or ds.schema.sub_label(col, " |") for col in relevant_cols]
+
+    # ✅ Each statement converted once to integer codes, full count matrix in one pass
+    counts, percents, totals = tabulate_battery(df, relevant_cols, list(option_map), rows)
+    count_matrix = counts.tolist()
+    percent_matrix = percents.tolist()
+    col_totals = totals.tolist()
+    summary = scale_summary(counts, list(option_map), totals)
 
     # ✅ Get clean filename
     filename_only = os.path.basename(filepath)
 
     # ✅ Extract all question codes from Answer Key
-    question_columns = []
-    for _, row in df_key.iterrows():
-        if pd.notna(row[0]):
-            code = str(row[0]).strip()
-            if re.match(r'^Q\d+$', code):
-                question_columns.append(code)
-    question_columns = list(dict.fromkeys(question_columns))
+    question_columns = answer_key.question_ids(base_only=True)
     
     if filters.get("sort_column") == "asc":
         percent_matrix, count_matrix, row_labels = zip(*sorted(
@@ -67,11 +76,8 @@ def get_matrix_question_data(filepath, sheet, column, filters):
         ))
         
     question_text = column
-    for _, row in df_key.iterrows():
-        if pd.notna(row[0]) and str(row[0]).strip() == base_prefix:
-            if pd.notna(row[1]):
-                question_text = f"{base_prefix}: {str(row[1]).strip()}"
-            break
+    if answer_key.question_text(base_prefix):
+        question_text = f"{base_prefix}: {answer_key.question_text(base_prefix)}"
 
     return{
         "question_text": question_text,
@@ -82,7 +88,8 @@ def get_matrix_question_data(filepath, sheet, column, filters):
         "col_totals": col_totals,
         "question_code":column,
         "all_columns":question_columns,
-        "sort_column_options":col_labels
+        "sort_column_options":col_labels,
+        **summary
     }
     
 def process_matrix_question(filepath, sheet, column, filters):
@@ -98,92 +105,53 @@ def process_matrix_question(filepath, sheet, column, filters):
 
 def process_matrix_question_qualtrics(filepath, sheet, column, filters):
     # Load data
-    df = pd.read_excel(filepath, sheet_name=sheet, header=2)
-    df.drop(index=0, inplace=True)
-
-    df_key = pd.read_excel(filepath, sheet_name="Answer key", header=None)
-    df_key[0] = df_key[0].ffill()
-    df = apply_global_filters(df, df_key, filters)
+    ds = load_dataset(filepath, sheet, "qualtrics")
+    answer_key = ds.answer_key
+    df = ds.df
+    rows = select_rows(ds, filters)
 
     base_qid = column.strip()
-    relevant_cols = [col for col in df.columns if col.startswith(base_qid + "_")]
-
-    # Extract column labels (sub-question text)
-    col_labels = []
-    try:
-        df_varinfo = pd.read_excel(filepath, sheet_name="Variable information", header=None)
-        raw_labels = []
-        for col in relevant_cols:
-            label = col
-            for _, row in df_varinfo.iterrows():
-                if pd.notna(row[0]) and str(row[0]).strip() == col and pd.notna(row[2]):
-                    label = str(row[2]).strip()
-                    break
-            raw_labels.append(label)
-
-        def longest_common_prefix(strings):
-            if not strings:
-                return ""
-            shortest = min(strings, key=len)
-            for i, ch in enumerate(shortest):
-                for other in strings:
-                    if i >= len(other) or other[i] != ch:
-                        return shortest[:i].strip(" :-–")
-            return shortest.strip(" :-–")
-
+    relevant_cols = ds.schema.columns(base_qid, "_")
+
+    def longest_common_prefix(strings):
+        if not strings:
+            return ""
+        shortest = min(strings, key=len)
+        for i, ch in enumerate(shortest):
+            for other in strings:
+                if i >= len(other) or other[i] != ch:
+                    return shortest[:i].strip(" :-–")
+        return shortest.strip(" :-–")
+
+    # Extract column labels (sub-question text from Variable information)
+    if ds.varinfo_df is not None:
+        raw_labels = [ds.schema.column_text(col, col).strip() for col in relevant_cols]
         prefix = longest_common_prefix(raw_labels)
         col_labels = [label[len(prefix):].strip(" :-–") for label in raw_labels]
-    except Exception as e:
+    else:
         col_labels = relevant_cols
 
     # Get question text
     question_text = base_qid
-    try:
-        texts = []
-        for _, row in df_varinfo.iterrows():
-            if pd.notna(row[0]) and str(row[0]).startswith(base_qid + "_") and pd.notna(row[2]):
-                texts.append(str(row[2]).strip())
-        if texts:
-            question_text = f"{base_qid}: {longest_common_prefix(texts)}"
-    except Exception as e:
-        print("Question text fallback error:", e)
+    texts = ds.schema.varinfo_texts(base_qid, sub_only=True)
+    if texts:
+        question_text = f"{base_qid}: {longest_common_prefix(texts)}"
 
     # Build row (scale) labels from answer key
     option_map = {}
 
-    for _, row in df_key.iterrows():
-        if pd.notna(row[0]) and str(row[0]).strip().startswith(base_qid + "_") and pd.notna(row[1]):
-            try:
-                code = str(int(float(row[1]))).strip()
-                label = str(row[2]).strip() if len(row) > 2 and pd.notna(row[2]) else str(row[1]).strip()
-                if code not in option_map:
-                    option_map[code] = label
-            except Exception as e:
-                print(f"Error parsing code-label from row: {row.tolist()} → {e}")
+    for qid in answer_key.question_ids():
+        if not qid.startswith(base_qid + "_"):
+            continue
+        for code, label in answer_key.options(qid):
+            option_map.setdefault(str(code), label)
 
     row_labels = list(option_map.values())
-    # col_totals = [df[col].notna().sum() for col in relevant_cols]
-    col_totals = [int(df[col].notna().sum()) for col in relevant_cols]
-    count_matrix = []
-    percent_matrix = []
-
-    for code, row_label in option_map.items():
-        row_counts = []
-        row_percents = []
-
-        for i, col in enumerate(relevant_cols):
-            # Normalize all values to string and compare
-            df_col_normalized = df[col].astype(str).str.strip()
-            match_series = df_col_normalized == str(code)
-
-            match_count = match_series.sum()
-
-            row_counts.append(match_count)
-            pct = (match_count / col_totals[i] * 100) if col_totals[i] else 0
-            row_percents.append(pct)
-
-        count_matrix.append(row_counts)
-        percent_matrix.append(row_percents)
+    counts, percents, totals = tabulate_battery(df, relevant_cols, list(option_map), rows)
+    count_matrix = counts.tolist()
+    percent_matrix = percents.tolist()
+    col_totals = totals.tolist()
+    summary = scale_summary(counts, list(option_map), totals)
         
     sort_order = filters.get("sort_column", "")
     if sort_order in ("asc", "desc"):
@@ -196,7 +164,7 @@ def process_matrix_question_qualtrics(filepath, sheet, column, filters):
         row_labels = list(row_labels)
 
     filename_only = os.path.basename(filepath)
-    all_columns = list(set(df_key[0].dropna().astype(str)))
+    all_columns = answer_key.question_ids()
 
     return render_template("results_matrix.html",
         question_text=question_text,
@@ -215,5 +183,6 @@ def process_matrix_question_qualtrics(filepath, sheet, column, filters):
         sheet=sheet,
         question_code=base_qid,
         all_columns=all_columns,
-        sort_column_options=col_labels
+        sort_column_options=col_labels,
+        **summary
     )
\ No newline at end of file
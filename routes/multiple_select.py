@@ -1,36 +1,26 @@
 from flask import render_template
-import pandas as pd
 from utils import apply_global_filters
-import re
+from dataset import load_dataset
 import os
 
 def get_multi_select_data(filepath, sheet, column, filters):
-    df = pd.read_excel(filepath, sheet_name=sheet, header=2)
-    df_key = pd.read_excel(filepath, sheet_name="Answer key", header=None)
-    df = apply_global_filters(df, df_key, filters)
+    ds = load_dataset(filepath, sheet)
+    answer_key = ds.answer_key
+    df = apply_global_filters(ds, filters)
     base_prefix = column.split(":")[0].strip()
-    relevant_cols = [col for col in df.columns if col.startswith(f"{base_prefix}:")]
+    relevant_cols = ds.schema.columns(base_prefix)
 
-    answer_labels = []
-    capture = False
+    answer_labels = answer_key.labels(base_prefix)
     question_text = base_prefix
-    for _, row in df_key.iterrows():
-        if pd.notna(row[0]) and str(row[0]).strip() == base_prefix:
-            capture = True
-            if pd.notna(row[1]):
-                question_text = f"{base_prefix}: {str(row[1]).strip()}"
-            continue
-        if capture and pd.isna(row[0]):
-            break
-        if capture and pd.notna(row[1]):
-            answer_labels.append(str(row[1]).strip())
+    if answer_key.question_text(base_prefix):
+        question_text = f"{base_prefix}: {answer_key.question_text(base_prefix)}"
 
     total_respondents = df[relevant_cols[0]].notna().sum() if relevant_cols else 0
     response_summary = []
     total_responses = 0
 
     for label in answer_labels:
-        col_match = next((col for col in relevant_cols if label in col), None)
+        col_match = ds.schema.column_for(base_prefix, label)
         count = (df[col_match] == 1).sum() if col_match else 0
         total_responses += count
         response_summary.append((label, count))
@@ -41,13 +31,7 @@ def get_multi_select_data(filepath, sheet, column, filters):
         pct_response = (count / total_responses * 100) if total_responses else 0
         final_data.append((label, count, pct_respondent, pct_response))
 
-    question_columns = []
-    for _, row in df_key.iterrows():
-        if pd.notna(row[0]):
-            code = str(row[0]).strip()
-            if re.match(r'^Q\\d+$', code):
-                question_columns.append(code)
-    question_columns = list(dict.fromkeys(question_columns))
+    question_columns = answer_key.question_ids(base_only=True)
 
     return {
         "question_text": question_text,
@@ -67,41 +51,29 @@ def process_multi_select(filepath, sheet, column, filters):
     return render_template("results_multiple_select.html", **data)
 
 def process_multi_select_qualtrics(filepath, sheet, column, filters):
-    import pandas as pd
-    import os
-    from flask import render_template
-    from utils import apply_global_filters
-
-    # ✅ Read data and drop label row if present
-    df = pd.read_excel(filepath, sheet_name=sheet, header=2)
-    df.drop(index=0, inplace=True)
-    df_key = pd.read_excel(filepath, sheet_name="Answer key", header=None)
-    df_key[0] = df_key[0].ffill()
-
-    df = apply_global_filters(df, df_key, filters)
+    # ✅ Label row is already dropped from the shared dataset
+    ds = load_dataset(filepath, sheet, "qualtrics")
+    answer_key = ds.answer_key
+
+    df = apply_global_filters(ds, filters)
     base_qid = column.strip()
 
     # ✅ Find sub-question columns like Q7_1, Q7_2, ...
-    relevant_cols = [col for col in df.columns if str(col).startswith(base_qid)]
+    relevant_cols = ds.schema.columns(base_qid, "_")
     print(f"[DEBUG] Relevant cols for {base_qid}: {relevant_cols}")
     for col in relevant_cols:
         print(f"[DEBUG] {col} → {df[col].dropna().unique().tolist()}")
 
     # ✅ Extract option labels from answer key
     option_labels = {}
-    for _, row in df_key.iterrows():
-        if pd.notna(row[0]) and str(row[0]).strip().startswith(base_qid + "_"):
-            try:
-                qid = str(row[0]).strip()
-                label = str(row[2]).strip() if len(row) > 2 and pd.notna(row[2]) else str(row[1]).strip()
-                option_labels[qid] = label
-            except:
-                continue
+    for qid in answer_key.question_ids():
+        if qid.startswith(base_qid + "_") and answer_key.labels(qid):
+            option_labels[qid] = answer_key.labels(qid)[-1]
 
     # ✅ Count selections using .notna()
     response_counts = []
     for qid, label in option_labels.items():
-        col = next((c for c in relevant_cols if c.startswith(qid)), None)
+        col = qid if qid in relevant_cols else None
         if col:
             count = df[col].notna().sum()
             response_counts.append((label, count))
@@ -117,32 +89,23 @@ def process_multi_select_qualtrics(filepath, sheet, column, filters):
 
     # ✅ Extract common question text from variable info
     question_text = base_qid
-    try:
-        df_varinfo = pd.read_excel(filepath, sheet_name="Variable information", header=None)
-        grouped_texts = []
-        for _, row in df_varinfo.iterrows():
-            if pd.notna(row[0]):
-                qid = str(row[0]).strip()
-                if qid.startswith(base_qid + "_") and pd.notna(row[2]):
-                    grouped_texts.append(str(row[2]).strip())
-
-        def longest_common_prefix(strings):
-            if not strings:
-                return ""
-            shortest = min(strings, key=len)
-            for i, ch in enumerate(shortest):
-                for other in strings:
-                    if i >= len(other) or other[i] != ch:
-                        return shortest[:i].strip(" :-–")
-            return shortest.strip(" :-–")
-
-        if grouped_texts:
-            question_text = f"{base_qid}: {longest_common_prefix(grouped_texts)}"
-    except:
-        pass
+    grouped_texts = ds.schema.varinfo_texts(base_qid, sub_only=True)
+
+    def longest_common_prefix(strings):
+        if not strings:
+            return ""
+        shortest = min(strings, key=len)
+        for i, ch in enumerate(shortest):
+            for other in strings:
+                if i >= len(other) or other[i] != ch:
+                    return shortest[:i].strip(" :-–")
+        return shortest.strip(" :-–")
+
+    if grouped_texts:
+        question_text = f"{base_qid}: {longest_common_prefix(grouped_texts)}"
 
     filename_only = os.path.basename(filepath)
-    all_columns = list(set(df_key[0].dropna().astype(str)))
+    all_columns = answer_key.question_ids()
 
     return render_template("results_multiple_select.html",
         question_text=question_text,
@@ -1,69 +1,86 @@
 from flask import render_template
-import pandas as pd
-import re
-from utils import apply_global_filters
+import numpy as np
+from utils import select_rows
+from dataset import load_dataset
+from tabulation import score_index, score_histogram, segment_index
 import os
 
+def nps_stats(hist, nps_digits=1):
+    """
+    Promoters / neutrals / detractors, NPS and average score per brand from an
+    [11 × B] score histogram (row i = score i); works on [S × 11 × B] too.
+    """
+    hist = np.asarray(hist)
+    totals = hist.sum(axis=-2)
+    promoters = hist[..., 9:11, :].sum(axis=-2)
+    neutrals = hist[..., 7:9, :].sum(axis=-2)
+    detractors = hist[..., 0:7, :].sum(axis=-2)
+    weighted = (np.arange(11)[:, None] * hist).sum(axis=-2)
+
+    safe = np.where(totals > 0, totals, 1)
+    nps = np.where(totals > 0, np.round((promoters - detractors) / safe * 100, nps_digits), 0.0)
+    avg = np.where(totals > 0, np.round(weighted / safe, 2), 0.0)
+    return {
+        "col_totals": totals,
+        "promoters": promoters,
+        "neutrals": neutrals,
+        "detractors": detractors,
+        "nps_scores": nps,
+        "average_scores": avg
+    }
+
+def _segment_results(ds, df, score_idx, segment_column, rows, nps_digits):
+    segment_labels, seg_idx = segment_index(ds.answer_key, df, segment_column, rows, ds.schema)
+    if seg_idx is None:
+        return {"segment_labels": [], "segment_totals": [], "segment_nps": []}
+    seg_hist = score_histogram(score_idx, 11, seg_idx, len(segment_labels))
+    seg_stats = nps_stats(seg_hist, nps_digits)
+    return {
+        "segment_labels": segment_labels,
+        "segment_totals": seg_stats["col_totals"].astype(int).tolist(),
+        "segment_nps": seg_stats["nps_scores"].astype(float).tolist()
+    }
+
 def get_nps_data(filepath, sheet, column, filters):
-    df = pd.read_excel(filepath, sheet_name=sheet, header=2)
-    df_key = pd.read_excel(filepath, sheet_name="Answer key", header=None)
-    df = apply_global_filters(df, df_key, filters)
+    ds = load_dataset(filepath, sheet)
+    answer_key = ds.answer_key
+    df = ds.df
+    rows = select_rows(ds, filters)
     base_prefix = column.split("|")[0].strip()
-    relevant_cols = [col for col in df.columns if col.startswith(f"{base_prefix} |")]
-    col_labels = [col.split("|")[1].strip() for col in relevant_cols]
+    relevant_cols = ds.schema.columns(base_prefix, " |")
+    col_labels = [ds.schema.sub_label(col, " |") for col in relevant_cols]
 
+    # ✅ InQuery codes scores 0–10 as 1–11: one 11 × brands histogram for everything
     row_labels = [str(i) for i in range(11)]
-    result_matrix = []
-    for score in row_labels:
-        row = []
-        value_to_count = int(score) + 1
-        for col in relevant_cols:
-            count = (df[col] == value_to_count).sum()
-            row.append(count)
-        result_matrix.append((score, row))
-
-    brand_columns = list(zip(*[row[1] for row in result_matrix]))
-    col_totals = [sum(col) for col in brand_columns]
-    promoters = [sum(col[9:11]) for col in brand_columns]
-    neutrals = [sum(col[7:9]) for col in brand_columns]
-    detractors = [sum(col[0:7]) for col in brand_columns]
-    nps_scores = [round(((p - d) / t) * 100, 1) if t else 0 for p, d, t in zip(promoters, detractors, col_totals)]
-    average_scores = [
-        round(sum(i * col[i] for i in range(11)) / sum(col), 2) if sum(col) > 0 else 0
-        for col in brand_columns
-    ]
+    score_idx = score_index(df, relevant_cols, rows, offset=1)
+    hist = score_histogram(score_idx, 11)[0]
+    result_matrix = [(score, hist[i].tolist()) for i, score in enumerate(row_labels)]
+    stats = nps_stats(hist, nps_digits=1)
 
     filename_only = os.path.basename(filepath)
 
-    question_columns = []
-    for _, row in df_key.iterrows():
-        if pd.notna(row[0]):
-            code = str(row[0]).strip()
-            if re.match(r'^Q\d+$', code):
-                question_columns.append(code)
-    question_columns = list(dict.fromkeys(question_columns))
+    question_columns = answer_key.question_ids(base_only=True)
     
     question_text = f"NPS Summary for {base_prefix}"
-    for _, row in df_key.iterrows():
-        if pd.notna(row[0]) and str(row[0]).strip() == base_prefix:
-            if pd.notna(row[1]):
-                question_text = f"{base_prefix}: {str(row[1]).strip()}"
-            break
+    if answer_key.question_text(base_prefix):
+        question_text = f"{base_prefix}: {answer_key.question_text(base_prefix)}"
 
-    return {
+    data = {
         "question_text":question_text,
         "row_labels":row_labels,
         "col_labels":col_labels,
         "result_matrix":result_matrix,
-        "col_totals":[int(x) for x in col_totals],
-        "promoters": [int(x) for x in promoters],
-        "neutrals": [int(x) for x in neutrals],
-        "detractors": [int(x) for x in detractors],
-        "nps_scores": [float(x) for x in nps_scores],
-        "average_scores": [float(x) for x in average_scores],
+        "col_totals":stats["col_totals"].astype(int).tolist(),
+        "promoters": stats["promoters"].astype(int).tolist(),
+        "neutrals": stats["neutrals"].astype(int).tolist(),
+        "detractors": stats["detractors"].astype(int).tolist(),
+        "nps_scores": stats["nps_scores"].astype(float).tolist(),
+        "average_scores": stats["average_scores"].astype(float).tolist(),
         "question_code": base_prefix,
         "all_columns": question_columns
     }
+    data.update(_segment_results(ds, df, score_idx, filters.get("segment_column"), rows, nps_digits=1))
+    return data
 
 def process_nps_question(filepath, sheet, column, filters):
     data = get_nps_data(filepath, sheet, column, filters)
@@ -74,19 +91,16 @@ def process_nps_question(filepath, sheet, column, filters):
     return render_template("results_nps.html", **data)
 
 def process_nps_question_qualtrics(filepath, sheet, column, filters):
-    # Read necessary sheets
-    df       = pd.read_excel(filepath, sheet_name=sheet, header=2)
-    df_key   = pd.read_excel(filepath, sheet_name="Answer key", header=None)
-    varinfo  = pd.read_excel(filepath, sheet_name="Variable information", header=None)
+    # Shared parsed dataset (responses only, text row dropped)
+    ds       = load_dataset(filepath, sheet, "qualtrics")
+    answer_key = ds.answer_key
 
-    # Apply any global filters (your existing function)
-    df = apply_global_filters(df, df_key, filters)
+    # Global filters → row positions (precomputed per dataset, see FilterIndex)
+    df   = ds.df
+    rows = select_rows(ds, filters)
 
     # Step 1: pick up any columns exactly == column or ending in _{column}
-    relevant_cols = [
-        col for col in df.columns
-        if col == column or col.endswith(f"_{column}")
-    ]
+    relevant_cols = ds.schema.loop_columns(column)
     if not relevant_cols:
         return f"No NPS columns found for base '{column}'"
 
@@ -94,11 +108,7 @@ def process_nps_question_qualtrics(filepath, sheet, column, filters):
     col_to_text    = {}
     question_texts = []
     for col in relevant_cols:
-        match = varinfo[varinfo[0] == col]
-        if not match.empty and pd.notna(match.iloc[0][2]):
-            full_text = str(match.iloc[0][2])
-        else:
-            full_text = col
+        full_text = ds.schema.column_text(col, col)
         col_to_text[col] = full_text
         question_texts.append(full_text)
 
@@ -117,49 +127,27 @@ def process_nps_question_qualtrics(filepath, sheet, column, filters):
         for col in relevant_cols
     ]
 
-    # Step 4: calculate NPS stats
-    promoters      = []
-    neutrals       = []
-    detractors     = []
-    nps_scores     = []
-    average_scores = []
-    col_totals     = []
-    score_range    = list(range(0, 11))
-    result_matrix  = []
-
-    for col in relevant_cols:
-        scores = pd.to_numeric(df[col], errors='coerce').dropna().astype(int)
-        total  = int(len(scores))
-
-        prom  = int((scores >= 9).sum())
-        neut  = int(((scores >= 7) & (scores <= 8)).sum())
-        detr  = int((scores <= 6).sum())
-
-        nps = float(round((prom - detr) / total * 100, 2)) if total else 0.0
-        avg = float(round(scores.mean(), 2))              if total else 0.0
+    # Step 4: one 0–10 × brands histogram, all stats derived from it
+    score_range   = list(range(0, 11))
+    score_idx     = score_index(df, relevant_cols, rows)
+    hist          = score_histogram(score_idx, 11)[0]
+    stats         = nps_stats(hist, nps_digits=2)
 
-        promoters.append(prom)
-        neutrals.append(neut)
-        detractors.append(detr)
-        nps_scores.append(nps)
-        average_scores.append(avg)
-        col_totals.append(total)
+    promoters      = stats["promoters"].astype(int).tolist()
+    neutrals       = stats["neutrals"].astype(int).tolist()
+    detractors     = stats["detractors"].astype(int).tolist()
+    nps_scores     = stats["nps_scores"].astype(float).tolist()
+    average_scores = stats["average_scores"].astype(float).tolist()
+    col_totals     = stats["col_totals"].astype(int).tolist()
 
-    # Step 5: build distribution matrix as (score_str, [counts…])
-    for score in score_range:
-        row = [int((df[col] == score).sum()) for col in relevant_cols]
-        result_matrix.append((str(score), row))
+    # Step 5: distribution matrix as (score_str, [counts…])
+    result_matrix  = [(str(score), hist[score].tolist()) for score in score_range]
+    segments       = _segment_results(ds, df, score_idx, filters.get("segment_column"), rows, nps_digits=2)
 
     filename_only = os.path.basename(filepath)
 
     # Sidebar: list all Q-codes from the answer key
-    question_columns = []
-    for _, row in df_key.iterrows():
-        if pd.notna(row[0]):
-            code = str(row[0]).strip()
-            if re.match(r'^Q\d+$', code):
-                question_columns.append(code)
-    question_columns = list(dict.fromkeys(question_columns))
+    question_columns = answer_key.question_ids(base_only=True)
 
     return render_template("results_nps.html",
         filename          = filename_only,
@@ -174,5 +162,6 @@ def process_nps_question_qualtrics(filepath, sheet, column, filters):
         result_matrix     = result_matrix,
         col_totals        = col_totals,
         question_code     = column,
-        all_columns       = question_columns
+        all_columns       = question_columns,
+        **segments
     )
\ No newline at end of file
@@ -1,5 +1,6 @@
 from routes.nps_question import get_nps_data
 from routes.matrix_question import get_matrix_question_data
+from routes.cross_cut import get_cross_cut_data, get_cross_cut_data_qualtrics
 
 def build_nps_slide(filepath, sheet, qid, filters):
     out = get_nps_data(filepath, sheet, qid, filters)
@@ -39,6 +40,24 @@ def build_matrix_slide(filepath, sheet, qid, filters):
         "QuestionTextMatrix": [[{"string": question_text}]],
         "MatrixChart": [header] + table
     }
+
+def build_cross_cut_slide(filepath, sheet, qid, filters, data_format="inquery"):
+    if data_format == "qualtrics":
+        out = get_cross_cut_data_qualtrics(filepath, sheet, qid, filters)
+    else:
+        out = get_cross_cut_data(filepath, sheet, qid, filters)
+
+    # Rows = base options, columns = cut buckets (same chart as a matrix question)
+    header = [None] + [{"string": c} for c in out["cut_headers"]]
+    table = []
+    for label, _, counts in out["result_matrix"]:
+        row = [{"string": label}] + [{"number": v} for v in counts]
+        table.append(row)
+
+    return {
+        "QuestionTextMatrix": [[{"string": out["question_text"]}]],
+        "MatrixChart": [header] + table
+    }
     
 def build_single_choice_slide(filepath, sheet, qids, filters):
     from routes.single_choice import get_single_choice_data
@@ -1,9 +1,24 @@
-import os,re
+import os
 import pickle
+import threading
+from collections import OrderedDict
 import pandas as pd
 from typing import List
 import numpy as np
-import faiss
+from ann_index import build_index, configure_search, index_type, kind_of
+from dataset import file_hash, load_dataset
+from embedding_store import embedding_store
+from openai_embeddings import EMBEDDING_MODEL, embed_texts, get_client
+from rag_snapshot import DocumentFile, load_snapshot, replace_index, save_snapshot, snapshot_path
+
+# Ready assistants (documents, embeddings, FAISS index, decoded frame) per
+# (upload content, sheet), reused by /chat. Bounded by count and by their
+# estimated memory footprint; the most recent one is always kept.
+MAX_CACHED_RAGS = 4
+MAX_RAG_CACHE_BYTES = 1024 * 1024 * 1024
+
+_rags = OrderedDict()
+_rags_lock = threading.Lock()
 
 class SurveyRAG:
     def __init__(self, upload_folder: str, filename: str, raw_sheet: str, key_sheet: str = "Answer key"):
@@ -11,37 +26,98 @@ class SurveyRAG:
         self.raw_sheet = raw_sheet
         self.key_sheet = key_sheet
 
+        self.file_hash = None
         self.raw_df = None
         self.key_df = None
+        self.answer_key = None
         self.documents = []
         self.embeddings = None
         self.index = None
+        self._decoded_df = None
+        self._lock = threading.Lock()
 
     def load_excel(self):
-        self.raw_df = pd.read_excel(self.filepath, sheet_name=self.raw_sheet, header=2)
-        self.key_df = pd.read_excel(self.filepath, sheet_name=self.key_sheet, header=None)
+        # Shared with the question processors: parsed once, then served from the dataset cache
+        ds = load_dataset(self.filepath, self.raw_sheet)
+        self.file_hash = ds.file_hash
+        self.raw_df = ds.raw_df
+        self.key_df = ds.key_df
+        self.answer_key = ds.answer_key
         self.df = self.raw_df
 
+    def prepare(self, embed=True):
+        """
+        Load, build the documents and (with embed) the embeddings + FAISS index
+        — each only once per instance. A snapshot from an earlier build of the
+        same data is mapped instead of rebuilt.
+        """
+        with self._lock:
+            if self.raw_df is None:
+                self.load_excel()
+            if self.index is None:
+                self.restore_snapshot()
+            if not self.documents:
+                self.convert_to_documents(max_rows=None)
+            if embed and self.index is None:
+                self.embed_documents()
+                self.build_faiss_index()
+                self.persist_snapshot()
+        return self
+
+    def snapshot_path(self):
+        return snapshot_path(self.file_hash, self.raw_sheet, EMBEDDING_MODEL)
+
+    def restore_snapshot(self) -> bool:
+        """Documents, embeddings and index of this upload as memory-mapped views (no parsing, no copies)."""
+        snapshot = load_snapshot(self.snapshot_path())
+        if snapshot is None:
+            return False
+        self.documents, self.embeddings, self.index = snapshot
+        if kind_of(self.index) != index_type(self.index.ntotal):
+            # RAG_INDEX_TYPE changed (or the corpus crossed a size threshold): re-index the mapped vectors
+            self.build_faiss_index()
+            replace_index(self.snapshot_path(), self.index)
+        else:
+            configure_search(self.index)
+        return True
+
+    def persist_snapshot(self):
+        save_snapshot(self.snapshot_path(), self.documents, self.embeddings, self.index)
+
+    @property
+    def decoded_df(self) -> pd.DataFrame:
+        """raw_df with Answer key labels instead of codes (for the SQL agent), decoded once."""
+        if self._decoded_df is None:
+            from routes.sql_agent_utils import decode_raw_df
+            self._decoded_df = decode_raw_df(self.raw_df, self.answer_key)
+        return self._decoded_df
+
+    def memory_bytes(self) -> int:
+        """Estimated footprint: frames, document text, embeddings and the index vectors."""
+        if isinstance(self.documents, DocumentFile):
+            size = self.documents.nbytes
+        else:
+            size = sum(len(doc) for doc in self.documents)
+        for df in (self.raw_df, self._decoded_df):
+            if df is not None:
+                size += int(df.memory_usage(index=False).sum())
+        if self.embeddings is not None:
+            size += self.embeddings.nbytes
+        if self.index is not None:
+            size += self.index.ntotal * self.index.d * 4
+        return size
+
     def convert_to_documents(self, max_rows=None) -> List[str]:
         docs = []
 
-        # Step 1: Parse answer key mapping
-        code_map = {}  # e.g., {'Q2': {'1': 'United States', '2': 'India'}}
-        current_qid = None
-        for _, row in self.key_df.iterrows():
-            qid = str(row[0]).strip() if pd.notna(row[0]) else ""
-            label = str(row[1]).strip() if pd.notna(row[1]) else ""
-
-            if re.match(r"^Q\d+$", qid):
-                current_qid = qid
-                code_map[current_qid] = {}
-            elif current_qid and qid and label:
-                code_map[current_qid][str(qid)] = label
+        # Step 1: Answer key mapping, e.g. Q2 → {'1': 'United States', '2': 'India'}
+        answer_key = self.answer_key
+        coded_qids = set(answer_key.question_ids(base_only=True))
 
         # Step 2: Add answer key info into the context
-        for qid, options in code_map.items():
+        for qid in answer_key.question_ids(base_only=True):
             question_text = f"Question {qid}:\n"
-            for code, label in options.items():
+            for code, label in answer_key.options(qid):
                 question_text += f"- {label}: {code}\n"
             docs.append(question_text.strip())
 
@@ -55,8 +131,9 @@ class SurveyRAG:
                     decoded_val = val_str
 
                     # Try decoding if column matches a Qx
-                    if col in code_map and val_str in code_map[col]:
-                        decoded_val = code_map[col][val_str] + f" ({val_str})"
+                    label = answer_key.label_for(col, val_str) if col in coded_qids else None
+                    if label is not None:
+                        decoded_val = label + f" ({val_str})"
 
                     lines.append(f"{col}: {decoded_val}")
             docs.append("\n".join(lines))
@@ -67,71 +144,100 @@ class SurveyRAG:
         return docs
 
     def get_cache_path(self):
+        """Pre-store pickle cache (name + sheet keyed); only read to seed the embedding store."""
         base = os.path.splitext(os.path.basename(self.filepath))[0]
-        os.makedirs("cache", exist_ok=True)
         return f"cache/{base}_{self.raw_sheet.replace(' ', '_')}_openai_embed.pkl"
 
-    def load_from_cache(self):
-        path = self.get_cache_path()
-        if os.path.exists(path):
-            with open(path, 'rb') as f:
-                data = pickle.load(f)
-                self.documents = data['documents']
-                self.embeddings = data['embeddings']
-            return True
-        return False
-
-    def save_to_cache(self):
+    def import_legacy_cache(self, store):
+        """Move a pickle cache's vectors into the store — keyed by text, so stale ones just never match."""
         path = self.get_cache_path()
-        with open(path, 'wb') as f:
-            pickle.dump({
-                'documents': self.documents,
-                'embeddings': self.embeddings
-            }, f)
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        if len(data.get('documents', [])) != len(data.get('embeddings', [])):
+            return 0
+        return store.add(data['documents'], data['embeddings'])
 
     def embed_documents(self):
-        if self.load_from_cache():
-            print("✅ Loaded OpenAI embeddings from cache.")
-            return self.embeddings
-
+        """
+        Embeddings of the documents from the content-addressed store; only
+        documents whose text was never embedded with EMBEDDING_MODEL (in any
+        upload) go to the API.
+        """
         if not self.documents:
             raise ValueError("❌ No documents to embed.")
 
-        print("🔄 Getting OpenAI embeddings...")
-        self.embeddings = self.get_openai_embeddings(self.documents)
-        self.save_to_cache()
-        return self.embeddings
+        store = embedding_store(EMBEDDING_MODEL)
+        vectors, missing = store.lookup(self.documents)
+        if missing and self.import_legacy_cache(store):
+            vectors, missing = store.lookup(self.documents)
+
+        if missing:
+            print(f"🔄 Getting OpenAI embeddings for {len(missing)} of {len(self.documents)} documents...")
+            new = np.asarray(self.get_openai_embeddings([self.documents[i] for i in missing]), dtype=np.float32)
+            store.add([self.documents[i] for i in missing], new)
+            if vectors is None:
+                vectors = new
+            else:
+                vectors[missing] = new
+        else:
+            print("✅ Loaded OpenAI embeddings from cache.")
 
-    def get_openai_embeddings(self, texts: List[str], model="text-embedding-3-small") -> List[List[float]]:
-        from openai import OpenAI
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.embeddings = vectors
+        return self.embeddings
 
-        embeddings = []
-        batch_size = 100
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i+batch_size]
-            response = client.embeddings.create(input=batch, model=model)
-            batch_embeddings = [record.embedding for record in response.data]
-            embeddings.extend(batch_embeddings)
-        return embeddings
+    def get_openai_embeddings(self, texts: List[str], model=EMBEDDING_MODEL) -> np.ndarray:
+        # Token-sized batches in parallel over the shared client, with backoff (see openai_embeddings)
+        return embed_texts(texts, model)
 
     def build_faiss_index(self):
         if self.embeddings is None:
             raise ValueError("❌ No embeddings found. Run embed_documents() first.")
-        emb = np.array(self.embeddings).astype('float32')
-        dim = emb.shape[1]
-        self.index = faiss.IndexFlatL2(dim)
-        self.index.add(emb)
+        # Flat / HNSW / IVF-Flat / IVF-PQ by corpus size or RAG_INDEX_TYPE (see ann_index)
+        self.index = build_index(self.embeddings)
 
     def retrieve(self, query: str, top_k: None = None) -> List[str]:
-        from openai import OpenAI
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        client = get_client()
 
         response = client.embeddings.create(
             input=[query],
-            model="text-embedding-3-small"
+            model=EMBEDDING_MODEL
         )
         query_vec = np.array([response.data[0].embedding]).astype('float32')
         D, I = self.index.search(query_vec, top_k)
-        return [self.documents[i] for i in I[0]]
-    
+        # IVF / HNSW pad with -1 when the searched buckets hold fewer than top_k hits
+        return [self.documents[i] for i in I[0] if i >= 0]
+
+
+def _evict_rags():
+    with _rags_lock:
+        total = sum(rag.memory_bytes() for rag in _rags.values())
+        while len(_rags) > 1 and (len(_rags) > MAX_CACHED_RAGS or total > MAX_RAG_CACHE_BYTES):
+            _, evicted = _rags.popitem(last=False)
+            total -= evicted.memory_bytes()
+
+
+def get_survey_rag(upload_folder: str, filename: str, sheet: str, embed=True) -> SurveyRAG:
+    """
+    The ready SurveyRAG for (upload content, sheet) from the process cache,
+    built on first use. Concurrent callers share one instance and wait for
+    its preparation instead of building it twice. embed=False skips the
+    embeddings + index (SQL agent questions only need the frames).
+    """
+    key = (file_hash(os.path.join(upload_folder, filename)), sheet)
+    with _rags_lock:
+        rag = _rags.get(key)
+        if rag is None:
+            rag = _rags[key] = SurveyRAG(upload_folder, filename, sheet)
+        _rags.move_to_end(key)
+
+    try:
+        rag.prepare(embed)
+    except Exception:
+        with _rags_lock:
+            if _rags.get(key) is rag:
+                del _rags[key]
+        raise
+    _evict_rags()
+    return rag
@@ -1,43 +1,90 @@
 from flask import render_template
 import pandas as pd
-import re
-from utils import apply_global_filters
+import numpy as np
+from utils import select_rows
+from dataset import load_dataset
+from tabulation import column_values, numeric_matrix, score_positions, score_histogram, segment_index
 import os
 
-def get_ranked_data(filepath, sheet, column, filters):
-    df = pd.read_excel(filepath, sheet_name=sheet, header=2)
-    df_key = pd.read_excel(filepath, sheet_name="Answer key", header=None)
-
-    df = apply_global_filters(df, df_key, filters)
-    base_prefix = column.split(":")[0].strip()
-    relevant_cols = [col for col in df.columns if col.startswith(f"{base_prefix}:")]
-
-    actual_max = 0
-    for col in relevant_cols:
-        col_max = pd.to_numeric(df[col], errors='coerce').max()
-        if pd.notna(col_max) and col_max > actual_max:
-            actual_max = int(col_max)
-
+def rank_stats(hist):
+    """
+    Average rank and Borda points (max_rank points for rank 1 … 1 point for
+    rank max_rank) per item from a [ranks × items] histogram; works on
+    [segments × ranks × items] too.
+    """
+    hist = np.asarray(hist)
+    n_ranks = hist.shape[-2]
+    ranks = np.arange(1, n_ranks + 1)[:, None]
+    totals = hist.sum(axis=-2)
+    weighted = (ranks * hist).sum(axis=-2)
+    avg_rank = np.where(totals > 0, np.round(weighted / np.where(totals > 0, totals, 1), 2), 0.0)
+    borda = ((n_ranks + 1 - ranks) * hist).sum(axis=-2)
+    return avg_rank, borda
+
+def tabulate_ranks(answer_key, df, relevant_cols, rows, filters, schema=None):
+    """
+    Item × rank counts from one bincount over all rank columns, plus average
+    rank / Borda score per item and (with a segment column) per segment.
+    """
+    values = numeric_matrix(df, relevant_cols, rows)
+    actual_max = max(0, int(np.nanmax(values))) if values.size and not np.isnan(values).all() else 0
+
+    # A blank, unparsable, zero or negative max rank means every rank in the data
     try:
         max_rank = int(filters.get('max_rank', actual_max))
-        max_rank = min(max_rank, actual_max)
     except (ValueError, TypeError):
         max_rank = actual_max
+    max_rank = min(max_rank, actual_max) if max_rank > 0 else actual_max
 
-    rank_labels = [f"Rank {i}" for i in range(1, max_rank + 1)]
-    total_respondents = df[relevant_cols].notna().any(axis=1).sum()
+    rank_idx = score_positions(values, offset=1, n_scores=max_rank)
+    hist = score_histogram(rank_idx, max_rank)[0]          # ranks × items
+    avg_rank, borda = rank_stats(hist)
 
-    result_matrix = []
-    col_totals = [0] * max_rank
+    answered = np.zeros(len(values), dtype=bool)
     for col in relevant_cols:
-        label = col.split(":")[1].strip() if ":" in col else col
-        counts = []
-        for i in range(1, max_rank + 1):
-            count = (df[col] == i).sum()
-            counts.append(count)
-            col_totals[i - 1] += count
-        row_total = sum(counts)
-        result_matrix.append((label, row_total, counts))
+        answered |= pd.notna(column_values(df, col, rows))
+
+    segment_labels, seg_idx = segment_index(answer_key, df, filters.get("segment_column"), rows, schema)
+    segments = {"segment_labels": segment_labels, "segment_avg_rank": [], "segment_borda": []}
+    if seg_idx is not None:
+        seg_avg, seg_borda = rank_stats(score_histogram(rank_idx, max_rank, seg_idx, len(segment_labels)))
+        segments.update({
+            "segment_avg_rank": seg_avg.astype(float).tolist(),
+            "segment_borda": seg_borda.astype(int).tolist()
+        })
+
+    return {
+        "rank_labels": [f"Rank {i}" for i in range(1, max_rank + 1)],
+        "counts": hist.T,
+        "col_totals": hist.sum(axis=1).astype(int).tolist(),
+        "total_respondents": int(answered.sum()),
+        "avg_rank": avg_rank.astype(float).tolist(),
+        "borda": borda.astype(int).tolist(),
+        "segments": segments
+    }
+
+def get_ranked_data(filepath, sheet, column, filters):
+    ds = load_dataset(filepath, sheet)
+    answer_key = ds.answer_key
+
+    df = ds.df
+    rows = select_rows(ds, filters)
+    base_prefix = column.split(":")[0].strip()
+    relevant_cols = ds.schema.columns(base_prefix)
+
+    # ✅ One bincount for the whole item × rank matrix
+    ranks = tabulate_ranks(answer_key, df, relevant_cols, rows, filters, ds.schema)
+    rank_labels = ranks["rank_labels"]
+    col_totals = ranks["col_totals"]
+    total_respondents = ranks["total_respondents"]
+
+    result_matrix = []
+    rank_scores = []
+    for i, col in enumerate(relevant_cols):
+        label = ds.schema.sub_label(col, default=col)
+        counts = ranks["counts"][i].tolist()
+        result_matrix.append((label, sum(counts), counts))
+        rank_scores.append((label, ranks["avg_rank"][i], ranks["borda"][i]))
         
     row_labels = [label for label, _, _ in result_matrix]
     count_matrix = [counts for _, _, counts in result_matrix]
@@ -50,13 +97,7 @@ def get_ranked_data(filepath, sheet, column, filters):
 
     filename_only = os.path.basename(filepath)
 
-    question_columns = []
-    for _, row in df_key.iterrows():
-        if pd.notna(row[0]):
-            code = str(row[0]).strip()
-            if re.match(r'^Q\d+$', code):
-                question_columns.append(code)
-    question_columns = list(dict.fromkeys(question_columns))
+    question_columns = answer_key.question_ids(base_only=True)
     
     if filters.get("sort_column") == "asc":
         percent_matrix, count_matrix, row_labels = zip(*sorted(
@@ -68,11 +109,8 @@ def get_ranked_data(filepath, sheet, column, filters):
         ))
         
     question_text = f"Ranked Summary for {base_prefix}"
-    for _, row in df_key.iterrows():
-        if pd.notna(row[0]) and str(row[0]).strip() == base_prefix:
-            if pd.notna(row[1]):
-                question_text = f"{base_prefix}: {str(row[1]).strip()}"
-            break
+    if answer_key.question_text(base_prefix):
+        question_text = f"{base_prefix}: {answer_key.question_text(base_prefix)}"
 
     return {
         "question_text": question_text,
@@ -84,7 +122,10 @@ def get_ranked_data(filepath, sheet, column, filters):
         "total_respondents": total_respondents,
         "sort_column_options": ["Overall"] + rank_labels,
         "question_code": base_prefix,
-        "all_columns": question_columns
+        "all_columns": question_columns,
+        "rank_scores": rank_scores,
+        "item_labels": [label for label, _, _ in result_matrix],
+        **ranks["segments"]
     }
     
 def process_ranked_question(filepath, sheet, column, filters):
@@ -98,26 +139,21 @@ def process_ranked_question(filepath, sheet, column, filters):
     return render_template("results_ranked.html", **data)
 
 def process_ranked_question_qualtrics(filepath, sheet, column, filters):
-    df = pd.read_excel(filepath, sheet_name=sheet, header=2)
-    df_key = pd.read_excel(filepath, sheet_name="Answer key", header=None)
-    varinfo = pd.read_excel(filepath, sheet_name="Variable information", header=None)
+    ds = load_dataset(filepath, sheet, "qualtrics")
+    answer_key = ds.answer_key
 
-    df = apply_global_filters(df, df_key, filters)
+    df = ds.df
+    rows = select_rows(ds, filters)
 
     base_prefix = column.split("_")[0].strip()
-    relevant_cols = [col for col in df.columns if col.startswith(f"{base_prefix}_")]
+    relevant_cols = ds.schema.columns(base_prefix, "_")
 
     col_to_text = {}
     question_texts = []
     for col in relevant_cols:
-        row_match = varinfo[varinfo[0] == col]
-        if not row_match.empty:
-            full_text = str(row_match.iloc[0][2])
-            col_to_text[col] = full_text
-            question_texts.append(full_text)
-        else:
-            col_to_text[col] = col
-            question_texts.append(col)
+        full_text = ds.schema.column_text(col, col)
+        col_to_text[col] = full_text
+        question_texts.append(full_text)
 
     def get_common_prefix(strings):
         prefix = strings[0]
@@ -131,30 +167,18 @@ def process_ranked_question_qualtrics(filepath, sheet, column, filters):
     row_labels = [
         col_to_text[col].replace(common_prefix, '').strip(" :-") for col in relevant_cols
     ]
-    actual_max = 0
-    for col in relevant_cols:
-        col_max = pd.to_numeric(df[col], errors='coerce').max()
-        if pd.notna(col_max) and col_max > actual_max:
-            actual_max = int(col_max)
-
-    try:
-        max_rank = int(filters.get('max_rank', actual_max))
-        max_rank = min(max_rank, actual_max)
-    except (ValueError, TypeError):
-        max_rank = actual_max
-
-    rank_labels = [f"Rank {i}" for i in range(1, max_rank + 1)]
-    total_respondents = df[relevant_cols].notna().any(axis=1).sum()
+    ranks = tabulate_ranks(answer_key, df, relevant_cols, rows, filters, ds.schema)
+    rank_labels = ranks["rank_labels"]
+    col_totals = ranks["col_totals"]
+    total_respondents = ranks["total_respondents"]
 
     result_matrix = []
-    col_totals = [0] * max_rank
+    rank_scores = []
     for i, col in enumerate(relevant_cols):
         label = row_labels[i]
-        counts = [(df[col] == r).sum() for r in range(1, max_rank + 1)]
-        row_total = sum(counts)
-        result_matrix.append((label, row_total, counts))
-        for j, c in enumerate(counts):
-            col_totals[j] += c
+        counts = ranks["counts"][i].tolist()
+        result_matrix.append((label, sum(counts), counts))
+        rank_scores.append((label, ranks["avg_rank"][i], ranks["borda"][i]))
 
     percent_matrix = []
     for label, row_total, counts in result_matrix:
@@ -164,21 +188,15 @@ def process_ranked_question_qualtrics(filepath, sheet, column, filters):
 
     filename_only = os.path.basename(filepath)
 
-    question_columns = []
-    for _, row in df_key.iterrows():
-        if pd.notna(row[0]):
-            code = str(row[0]).strip()
-            if re.match(r'^Q\d+$', code):
-                question_columns.append(code)
-    question_columns = list(dict.fromkeys(question_columns))
+    question_columns = answer_key.question_ids(base_only=True)
     
     sort_order = filters.get("sort_column", "")
     if sort_order in ("asc", "desc") and percent_matrix:
         reverse = sort_order == "desc"
-        combined = list(zip(percent_matrix, result_matrix))
+        combined = list(zip(percent_matrix, result_matrix, rank_scores))
         combined.sort(key=lambda x: x[0][1], reverse=reverse)  # sort by overall %
-        percent_matrix, result_matrix = zip(*combined)
-        percent_matrix, result_matrix = list(percent_matrix), list(result_matrix)
+        percent_matrix, result_matrix, rank_scores = zip(*combined)
+        percent_matrix, result_matrix, rank_scores = list(percent_matrix), list(result_matrix), list(rank_scores)
 
     return render_template("results_ranked.html",
         question_text=common_prefix,
@@ -194,5 +212,8 @@ def process_ranked_question_qualtrics(filepath, sheet, column, filters):
         filename=filename_only,
         sheet=sheet,
         question_code=base_prefix,
-        all_columns=question_columns
+        all_columns=question_columns,
+        rank_scores=rank_scores,
+        item_labels=row_labels,
+        **ranks["segments"]
     )
\ No newline at end of file
@@ -1,65 +1,116 @@
 from flask import render_template
-import pandas as pd
-from utils import apply_global_filters
+import numpy as np
+from utils import select_rows
+from dataset import load_dataset
+from tabulation import numeric_matrix, score_histogram, segment_index
+import math
 import os
 
-BUCKETS = [(0, 10), (11, 20), (21, 30), (31, 40), (41, 50),
-           (51, 60), (61, 70), (71, 80), (81, 90), (91, 100)]
+# Bucket edges: first bucket is [0, 10], every later one is (low, high]
+BUCKET_EDGES = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100]
+
+def _fmt(value):
+    return str(int(value)) if float(value).is_integer() else str(value)
 
 def bucket_label(low, high):
-    return f"{low}–{high}"
+    return f"{_fmt(low)}–{_fmt(high)}"
+
+def bucket_labels(edges):
+    """'0–10', '>10–20', '>20–30', …: bins are right-closed, so 10.5 falls in '>10–20'."""
+    return [bucket_label(low, high) if i == 0 else f">{bucket_label(low, high)}"
+            for i, (low, high) in enumerate(zip(edges[:-1], edges[1:]))]
 
-def get_bucket(val):
+def parse_bucket_edges(raw):
+    """
+    Comma-separated, strictly increasing edges from the form; BUCKET_EDGES
+    when left empty. Anything else raises ValueError with a message for the user.
+    """
+    if not str(raw or "").strip():
+        return BUCKET_EDGES
     try:
-        val = float(val)
-        for low, high in BUCKETS:
-            if low <= val <= high:
-                return bucket_label(low, high)
-    except:
-        return None
-    return None
+        edges = [float(x) for x in str(raw).split(",") if x.strip()]
+    except ValueError:
+        raise ValueError(f"Share of Wallet buckets '{raw}' must be comma-separated numbers, e.g. 0,25,50,75,100")
+    if not all(math.isfinite(e) for e in edges):
+        raise ValueError(f"Share of Wallet buckets '{raw}' must be comma-separated numbers, e.g. 0,25,50,75,100")
+    if len(edges) < 2:
+        raise ValueError(f"Share of Wallet buckets '{raw}' need at least two edges")
+    if any(b <= a for a, b in zip(edges, edges[1:])):
+        raise ValueError(f"Share of Wallet buckets '{raw}' must be strictly increasing")
+    return [int(e) if e.is_integer() else e for e in edges]
 
-def get_sow_data(filepath, sheet, question_prefix, filters):
-    df = pd.read_excel(filepath, sheet_name=sheet, header=2)
-    df_key = pd.read_excel(filepath, sheet_name="Answer key", header=None)
-    df = apply_global_filters(df, df_key, filters)
+def bucket_index(values, edges):
+    """
+    Bucket position of every value (right-closed bins, first bin also
+    includes the lowest edge); -1 for NaN and values outside the edges.
+    """
+    edges = np.asarray(edges, dtype=np.float64)
+    idx = np.digitize(values, edges[1:-1], right=True)
+    in_range = (values >= edges[0]) & (values <= edges[-1])
+    return np.where(in_range, idx, -1)
 
-    relevant_cols = [col for col in df.columns if isinstance(col, str) and col.startswith(f"{question_prefix}:")]
-    brands = [col.split(":", 1)[1].strip() for col in relevant_cols]
+def _column_stats(values):
+    """Per-brand mean / median over answered cells, 0 for brands nobody answered."""
+    answered = ~np.isnan(values)
+    counts = answered.sum(axis=0)
+    sums = np.where(answered, values, 0.0).sum(axis=0)
+    means = np.where(counts > 0, sums / np.where(counts > 0, counts, 1), 0.0)
+    medians = np.zeros(values.shape[1])
+    has_data = counts > 0
+    if has_data.any():
+        medians[has_data] = np.nanmedian(values[:, has_data], axis=0)
+    return np.round(means, 2), np.round(medians, 2)
 
-    # Build bucket map
-    bucket_counts = {bucket_label(l, h): [0] * len(brands) for l, h in BUCKETS}
-    col_totals = [0] * len(brands)
+def get_sow_data(filepath, sheet, question_prefix, filters):
+    ds = load_dataset(filepath, sheet)
+    df = ds.df
+    rows = select_rows(ds, filters)
+
+    relevant_cols = ds.schema.columns(question_prefix)
+    brands = [ds.schema.sub_label(col) for col in relevant_cols]
 
-    for col_idx, col in enumerate(relevant_cols):
-        series = pd.to_numeric(df[col], errors='coerce').dropna()
-        col_totals[col_idx] = len(series)
+    # ✅ One numeric matrix (respondents × brands), bucketed and counted in one bincount
+    edges = parse_bucket_edges(filters.get("sow_buckets"))
+    values = numeric_matrix(df, relevant_cols, rows)
+    bucket_idx = bucket_index(values, edges)
+    row_labels = bucket_labels(edges)
+    counts = score_histogram(bucket_idx, len(row_labels))[0]
 
-        for val in series:
-            bucket = get_bucket(val)
-            if bucket:
-                bucket_counts[bucket][col_idx] += 1
+    col_totals = (~np.isnan(values)).sum(axis=0)
+    mean_shares, median_shares = _column_stats(values)
 
-    bucket_labels = list(bucket_counts.keys())
-    count_matrix = [bucket_counts[label] for label in bucket_labels]
+    # ✅ Optional segment column: mean share per segment × brand
+    segment_labels, seg_idx = segment_index(ds.answer_key, df, filters.get("segment_column"), rows, ds.schema)
+    segment_means = []
+    segment_totals = []
+    for s in range(len(segment_labels)):
+        seg_values = values[seg_idx == s]
+        segment_means.append(_column_stats(seg_values)[0].astype(float).tolist())
+        segment_totals.append((~np.isnan(seg_values)).sum(axis=0).astype(int).tolist())
 
     filename_only = os.path.basename(filepath)
 
     return {
         "question_text":f"{question_prefix}: Share of Wallet Distribution",
-        "row_labels":bucket_labels,
+        "row_labels":row_labels,
         "col_labels":brands,
-        "count_matrix":count_matrix,
-        "col_totals":col_totals,
+        "count_matrix":counts.tolist(),
+        "col_totals":col_totals.astype(int).tolist(),
+        "mean_shares": mean_shares.astype(float).tolist(),
+        "median_shares": median_shares.astype(float).tolist(),
+        "bucket_edges": edges,
+        "segment_labels": segment_labels,
+        "segment_means": segment_means,
+        "segment_totals": segment_totals,
         "question_code": question_prefix,
         "all_columns": [],
         "sort_column_options": []
     }
-    
+
 def process_share_of_wallet(filepath, sheet, column, filters):
     data = get_sow_data(filepath, sheet, column, filters)
     data.update({
         "filename": os.path.basename(filepath),
         "sheet": sheet
     })
-    return render_template("results_sow.html", **data)
\ No newline at end of file
+    return render_template("results_sow.html", **data)
@@ -1,53 +1,40 @@
 import os
-import re
 import pandas as pd
 from langchain_experimental.agents import create_pandas_dataframe_agent
 from langchain_openai import ChatOpenAI
 from langchain.agents.agent_types import AgentType
+from answer_key import AnswerKey
 
-def decode_raw_df(raw_df: pd.DataFrame, key_df: pd.DataFrame) -> pd.DataFrame:
+def decode_raw_df(raw_df: pd.DataFrame, answer_key: AnswerKey) -> pd.DataFrame:
     """
-    Replace coded values in raw_df using mappings from key_df
+    Replace coded values in raw_df using mappings from the answer key
     Returns a decoded version of the DataFrame
     """
     decoded_df = raw_df.copy()
 
-    # Step 1: Build mapping dictionary {Qx: {code: label}}
-    code_map = {}
-    current_qid = None
-
-    for _, row in key_df.iterrows():
-        qid = str(row[0]).strip() if pd.notna(row[0]) else ""
-        label = str(row[1]).strip() if pd.notna(row[1]) else ""
-
-        if re.match(r"^Q\d+$", qid):
-            current_qid = qid
-            code_map[current_qid] = {}
-        elif current_qid and qid and label:
-            code_map[current_qid][str(qid)] = label
-
-    # Step 2: Replace in raw_df
-    for qid, mapping in code_map.items():
-        if qid in decoded_df.columns:
-            decoded_df[qid] = decoded_df[qid].astype(str).map(mapping).fillna(decoded_df[qid])
+    for qid in answer_key.question_ids(base_only=True):
+        if qid in decoded_df.columns and answer_key.options(qid):
+            col = decoded_df[qid]
+            # Look up each distinct value once instead of every cell
+            lookup = {val: answer_key.label_for(qid, val) for val in col.dropna().unique()}
+            decoded_df[qid] = col.map(lookup).fillna(col)
 
     return decoded_df
 
 
-def run_sql_agent(user_query: str, raw_df: pd.DataFrame, key_df: pd.DataFrame):
+def run_sql_agent(user_query: str, raw_df: pd.DataFrame, answer_key: AnswerKey, decoded_df: pd.DataFrame = None):
 
-    # ✅ Decode values using Answer Key
-    decoded_df = decode_raw_df(raw_df, key_df)
+    # ✅ Decode values using Answer Key (unless the caller has it decoded already)
+    if decoded_df is None:
+        decoded_df = decode_raw_df(raw_df, answer_key)
+    # The agent runs generated code on the frame; keep a cached one untouched
+    decoded_df = decoded_df.copy()
 
     # ✅ Build Q-code → question label mapping
-    question_map = {}
-    current_qid = None
-    for _, row in key_df.iterrows():
-        qid = str(row[0]).strip() if pd.notna(row[0]) else ""
-        label = str(row[1]).strip() if pd.notna(row[1]) else ""
-        if re.match(r"^Q\d+$", qid):
-            current_qid = qid
-            question_map[current_qid] = label
+    question_map = {
+        qid: answer_key.question_text(qid, "")
+        for qid in answer_key.question_ids(base_only=True)
+    }
 
     # ✅ Build reference table for agent
     question_reference = "\n".join([f"- {qid}: {label}" for qid, label in question_map.items()])
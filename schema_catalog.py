@@ -0,0 +1,251 @@
+import json
+import re
+
+import pandas as pd
+
+SCHEMA_VERSION = 1
+
+# Separators between a QID and its sub-label in the column names:
+# InQuery 'Q3: Brand A' / 'Q4 | Brand A', Qualtrics 'Q5_1'
+SEPARATORS = (":", " |", "_")
+VARINFO_SUB_COLUMN = re.compile(r"^(Q\d+)_\d+$")
+
+
+def common_prefix(strings) -> str:
+    """Longest common prefix of the strings, without trailing ' :-–' punctuation."""
+    if not strings:
+        return ""
+    s1, s2 = min(strings), max(strings)
+    for i, ch in enumerate(s1):
+        if i >= len(s2) or ch != s2[i]:
+            return s1[:i].rstrip(" :-–")
+    return s1.rstrip(" :-–")
+
+
+class SchemaCatalog:
+    """
+    Column layout of one dataset, built once per upload and persisted next to
+    the dataset cache: which columns belong to which QID (per separator, in
+    sheet order), each column's sub-label, the Variable information / header
+    texts, and the question list shown on the picker page with its option codes
+    and detected types.
+
+    Lookups are dict hits on exact QIDs instead of prefix scans over all columns.
+    """
+
+    def __init__(self, data):
+        self.layout = data["layout"]
+        self._data = data
+        self._position = {col: i for i, col in enumerate(data["columns"])}
+        self._groups = data["groups"]
+        self._sub_labels = {
+            sep: {col: label for members in groups.values() for col, label in members}
+            for sep, groups in self._groups.items()
+        }
+        self._questions = data["questions"]
+
+    # ------------------------------------------------------------------
+    # Building / persistence
+    # ------------------------------------------------------------------
+    @classmethod
+    def build(cls, ds) -> "SchemaCatalog":
+        columns = [col for col in ds.df.columns if isinstance(col, str)]
+
+        # A column belongs to the QID before the first occurrence of each separator
+        groups = {sep: {} for sep in SEPARATORS}
+        loop_groups = {}
+        for col in columns:
+            for sep in SEPARATORS:
+                if sep in col:
+                    qid, label = col.split(sep, 1)
+                    groups[sep].setdefault(qid, []).append([col, label.strip()])
+            if "_" in col:
+                # Loop & merge style '<n>_Q9' columns, grouped by their last part
+                loop_groups.setdefault(col.rsplit("_", 1)[1], []).append(col)
+
+        column_texts, varinfo_groups = {}, {}
+        if ds.varinfo_df is not None and ds.varinfo_df.shape[1] >= 3:
+            for name, text in zip(ds.varinfo_df[0], ds.varinfo_df[2]):
+                if pd.isna(name) or pd.isna(text):
+                    continue
+                name = str(name).strip()
+                column_texts.setdefault(name, str(text))
+                varinfo_groups.setdefault(name.split("_", 1)[0], []).append([name, str(text).strip()])
+
+        header_texts = {}
+        if ds.question_text_row is not None:
+            header_texts = {col: str(ds.question_text_row[col]).strip() for col in columns}
+
+        data = {
+            "version": SCHEMA_VERSION,
+            "layout": ds.data_format,
+            "columns": columns,
+            "groups": groups,
+            "loop_groups": loop_groups,
+            "column_texts": column_texts,
+            "varinfo_groups": varinfo_groups,
+            "header_texts": header_texts,
+            "questions": {},
+            "types": {},
+        }
+        for q_type, qids in ds.question_scan.by_type.items():
+            for qid in qids:
+                data["types"].setdefault(qid, []).append(q_type)
+
+        catalog = cls(data)
+        for qid, text in catalog._question_map(ds.answer_key).items():
+            catalog._questions[qid] = {
+                "text": text,
+                "codes": [code for code, _ in ds.answer_key.options(qid)],
+            }
+        return catalog
+
+    @classmethod
+    def load(cls, path):
+        """The persisted catalog, or None when missing, unreadable or from an older version."""
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != SCHEMA_VERSION:
+            return None
+        return cls(data)
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self._data, f, ensure_ascii=False)
+
+    def _question_map(self, answer_key) -> dict:
+        """{QID: question text} for the picker page, ordered by question number."""
+        question_map = {}
+        if self.layout == "qualtrics":
+            # Variable information texts of the 'Qx_n' sub-columns, header row as fallback
+            for base in self._data["varinfo_groups"]:
+                texts = self.varinfo_texts(base, pattern=VARINFO_SUB_COLUMN)
+                if texts:
+                    question_map[base] = common_prefix(texts)
+
+            for col in self._data["columns"]:
+                m = re.match(r"^(Q\d+)", col)
+                if not m or m.group(1) in question_map:
+                    continue
+                qid = m.group(1)
+                texts = [self.header_text(c) for c in self.numbered_columns(qid)]
+                if len(texts) == 1:
+                    question_map[qid] = texts[0]
+                else:
+                    prefixes = [t.split(" - ")[0] for t in texts]
+                    question_map[qid] = prefixes[0] if len(set(prefixes)) == 1 else common_prefix(texts)
+        else:
+            data_qids = set()
+            for col in self._data["columns"]:
+                m = re.search(r"(Q\d+)", col)
+                if m:
+                    data_qids.add(m.group(1))
+            for key_qid in answer_key.question_ids():
+                m = re.match(r"(Q\d+)", key_qid)
+                text = answer_key.question_text(key_qid)
+                if m and text and answer_key.options(key_qid) and m.group(1) in data_qids:
+                    question_map[m.group(1)] = text
+
+        return {qid: question_map[qid] for qid in sorted(question_map, key=lambda q: int(q[1:]))}
+
+    # ------------------------------------------------------------------
+    # Columns
+    # ------------------------------------------------------------------
+    def columns(self, qid, *seps) -> list:
+        """Columns of `qid` for the given separators (default ':'), in sheet order."""
+        members = [col for sep in (seps or (":",)) for col, _ in self._groups[sep].get(qid, [])]
+        if len(seps) > 1:
+            members = sorted(set(members), key=self._position.get)
+        return members
+
+    def sub_label(self, col, sep=":", default=None):
+        """Text after the QID separator: 'Q3: Brand A' → 'Brand A'."""
+        return self._sub_labels[sep].get(col, default)
+
+    def column_for(self, qid, label, sep=":"):
+        """
+        The column of `qid` whose sub-label is exactly `label`; when none is,
+        the first one containing it (labels trimmed in the column names).
+        """
+        label = str(label).strip()
+        members = self._groups[sep].get(qid, [])
+        for col, sub_label in members:
+            if sub_label == label:
+                return col
+        return next((col for col, _ in members if label in col), None)
+
+    def question_columns(self, qid) -> list:
+        """The column holding `qid`, or its Qualtrics-style `qid_*` sub-columns."""
+        if qid in self._position:
+            return [qid]
+        return self.columns(qid, "_")
+
+    def loop_columns(self, qid) -> list:
+        """`qid` itself and its loop & merge copies '<n>_qid', in sheet order."""
+        members = list(self._data["loop_groups"].get(qid, []))
+        if qid in self._position:
+            members = sorted(members + [qid], key=self._position.get)
+        return members
+
+    def numbered_columns(self, qid) -> list:
+        """`qid`, 'qid_<n>' and 'qid:<n>' columns, in sheet order."""
+        pattern = re.compile(rf"^{re.escape(qid)}(?:[_:]\d+)?$")
+        candidates = self.columns(qid, ":", "_")
+        if qid in self._position:
+            candidates = sorted(candidates + [qid], key=self._position.get)
+        return [col for col in candidates if pattern.match(col)]
+
+    def columns_for_questions(self, qids) -> list:
+        """
+        Every column the given QIDs (or column names, 'Q3: Brand A' → Q3) can
+        read: own column, sub-columns for all separators and loop copies, in sheet order.
+        """
+        wanted = set()
+        for name in qids:
+            if not name:
+                continue
+            for qid in {name, re.split(r"[:|]", name)[0].strip()}:
+                wanted.update(self.question_columns(qid))
+                wanted.update(self.columns(qid, *SEPARATORS))
+                wanted.update(self.loop_columns(qid))
+        return sorted(wanted, key=self._position.get)
+
+    # ------------------------------------------------------------------
+    # Texts
+    # ------------------------------------------------------------------
+    def column_text(self, col, default=None):
+        """Variable information label of a raw column (first row for that column)."""
+        return self._data["column_texts"].get(col, default)
+
+    def varinfo_texts(self, qid, sub_only=False, pattern=None) -> list:
+        """
+        Variable information labels of the 'qid' and 'qid_*' rows in sheet order;
+        sub_only keeps the 'qid_*' rows, `pattern` further restricts the names.
+        """
+        return [
+            text for name, text in self._data["varinfo_groups"].get(qid, [])
+            if (not sub_only or "_" in name) and (pattern is None or pattern.match(name))
+        ]
+
+    def header_text(self, col, default=None):
+        """Qualtrics question-text row entry under a column."""
+        return self._data["header_texts"].get(col, default)
+
+    # ------------------------------------------------------------------
+    # Questions
+    # ------------------------------------------------------------------
+    def question_pairs(self) -> list:
+        return [(qid, q["text"]) for qid, q in self._questions.items()]
+
+    def question_codes(self, qid) -> list:
+        return list(self._questions.get(qid, {}).get("codes", []))
+
+    def types_for(self, qid) -> list:
+        return list(self._data["types"].get(qid, []))
+
+    def recommendations(self, qids) -> dict:
+        return {qid: self.types_for(qid) for qid in qids}
+
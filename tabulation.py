@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+
+from answer_key import AnswerKey, normalize_code
+from filter_index import question_columns
+
+
+def column_values(df: pd.DataFrame, col, rows=None) -> np.ndarray:
+    """
+    Values of one column, restricted to the selected row positions (None = all rows).
+    Compact nullable / categorical columns come back as their pandas array rather
+    than being boxed into an object ndarray.
+    """
+    series = df[col]
+    values = series.array if isinstance(series.dtype, pd.api.extensions.ExtensionDtype) else series.to_numpy()
+    return values if rows is None else values[rows]
+
+
+def code_index(values, codes) -> np.ndarray:
+    """
+    Map every value to the position of its code in `codes` (compared in
+    normalized form, so 1 == 1.0 == "1"); -1 for blanks and unknown codes.
+    Only the distinct values are looked up in Python.
+    """
+    positions = {}
+    for i, code in enumerate(codes):
+        positions.setdefault(normalize_code(code), i)
+
+    factor, uniques = pd.factorize(values)
+    # trailing -1 so that factorize's NaN sentinel (-1) maps to "no code"
+    lookup = np.array([positions.get(normalize_code(u), -1) for u in uniques] + [-1], dtype=np.int64)
+    return lookup[factor]
+
+
+def code_matrix(df: pd.DataFrame, cols, codes, rows=None) -> np.ndarray:
+    """[n × len(cols)] matrix of code positions (see code_index), one column per battery item."""
+    n = len(df) if rows is None else len(rows)
+    idx = np.full((n, len(cols)), -1, dtype=np.int64)
+    for j, col in enumerate(cols):
+        idx[:, j] = code_index(column_values(df, col, rows), codes)
+    return idx
+
+
+def crosstab(row_idx: np.ndarray, col_idx: np.ndarray, n_rows: int, n_cols: int) -> np.ndarray:
+    """
+    [n_rows × n_cols] count matrix of (row_idx, col_idx) pairs from a single
+    bincount over the combined integer code; pairs with a -1 are skipped.
+    """
+    valid = (row_idx >= 0) & (col_idx >= 0)
+    combined = row_idx[valid] * n_cols + col_idx[valid]
+    return np.bincount(combined, minlength=n_rows * n_cols).reshape(n_rows, n_cols)
+
+
+def cooccurrence(row_indicators: np.ndarray, col_indicators: np.ndarray) -> np.ndarray:
+    """
+    counts[i, j] = number of respondents with both row_indicators[:, i] and
+    col_indicators[:, j] set — one (BLAS) matrix product for the whole table.
+    """
+    product = row_indicators.T.astype(np.float64) @ col_indicators.astype(np.float64)
+    return np.rint(product).astype(np.int64)
+
+
+def indicator_crosstab(indicators: np.ndarray, col_idx: np.ndarray, n_cols: int) -> np.ndarray:
+    """
+    Crosstab for multi-column bases: `indicators` is an [n × m] bool matrix
+    (one column per option), so counts = indicatorsᵀ · one_hot(col_idx).
+    """
+    one_hot = np.zeros((len(col_idx), n_cols), dtype=bool)
+    valid = np.flatnonzero(col_idx >= 0)
+    one_hot[valid, col_idx[valid]] = True
+    return cooccurrence(indicators, one_hot)
+
+
+def percent_of(counts: np.ndarray, totals: np.ndarray) -> np.ndarray:
+    """counts / totals * 100 per column, 0 where the total is 0."""
+    totals = np.asarray(totals, dtype=np.float64)
+    safe = np.where(totals > 0, totals, 1.0)
+    return np.where(totals > 0, counts / safe * 100, 0.0)
+
+
+def numeric_matrix(df: pd.DataFrame, cols, rows=None) -> np.ndarray:
+    """[n × len(cols)] float matrix of the columns; blanks and non-numeric values are NaN."""
+    n = len(df) if rows is None else len(rows)
+    values = np.full((n, len(cols)), np.nan)
+    for j, col in enumerate(cols):
+        numeric = pd.to_numeric(pd.Series(column_values(df, col, rows)), errors="coerce")
+        values[:, j] = numeric.to_numpy(dtype=np.float64, na_value=np.nan)
+    return values
+
+
+def score_positions(values: np.ndarray, offset: int = 0, n_scores: int = 11) -> np.ndarray:
+    """
+    Int positions (value - offset) of a numeric matrix; -1 for NaN,
+    non-integers and values outside 0..n_scores-1.
+    """
+    pos = values - offset
+    valid = (pos >= 0) & (pos < n_scores) & (pos == np.floor(pos))
+    idx = np.full(values.shape, -1, dtype=np.int64)
+    idx[valid] = pos[valid].astype(np.int64)
+    return idx
+
+
+def score_index(df: pd.DataFrame, cols, rows=None, offset: int = 0, n_scores: int = 11) -> np.ndarray:
+    """score_positions of the columns, see numeric_matrix."""
+    return score_positions(numeric_matrix(df, cols, rows), offset, n_scores)
+
+
+def segment_index(answer_key: AnswerKey, df: pd.DataFrame, cut_column, rows=None, schema=None):
+    """
+    (segment labels, per-row segment position) for an optional cut column,
+    with segments taken from the cut question's Answer key options; ([], None)
+    when there is no usable cut column. `schema` (the dataset's SchemaCatalog)
+    resolves the cut column without scanning df.columns.
+    """
+    cut_column = (cut_column or "").strip()
+    if not cut_column:
+        return [], None
+    cut_prefix = cut_column.split(":")[0].strip()
+    cols = schema.question_columns(cut_column) if schema else question_columns(df, cut_column)
+    options = answer_key.options(cut_prefix)
+    if not cols or not options:
+        return [], None
+    seg_idx = code_index(column_values(df, cols[0], rows), [code for code, _ in options])
+    return [label for _, label in options], seg_idx
+
+
+def score_histogram(score_idx: np.ndarray, n_scores: int, segment_idx=None, n_segments: int = 1) -> np.ndarray:
+    """
+    [n_segments × n_scores × n_cols] counts from a single bincount over the
+    stacked (segment, score, column) code of every cell in `score_idx`.
+    Rows with segment -1 are skipped; without segment_idx everything is segment 0.
+    """
+    n, n_cols = score_idx.shape
+    if segment_idx is None:
+        segment_idx = np.zeros(n, dtype=np.int64)
+    combined = (segment_idx[:, None] * n_scores + score_idx) * n_cols + np.arange(n_cols)
+    valid = (score_idx >= 0) & (segment_idx[:, None] >= 0)
+    counts = np.bincount(combined[valid], minlength=n_segments * n_scores * n_cols)
+    return counts.reshape(n_segments, n_scores, n_cols)
@@ -0,0 +1,51 @@
+import importlib.util
+import os
+import zipfile
+from contextlib import contextmanager
+
+import pandas as pd
+
+# Reader backends, fastest first; "auto" picks the first one installed.
+#   calamine – Rust parser (pip install python-calamine), pandas engine="calamine"
+#   openpyxl – pandas' default engine, read-only streaming over the sheet XML
+# Parsed sheets are additionally cached as Parquet sidecars by dataset.load_dataset,
+# so a reader only runs the first time an upload is opened.
+READERS = {
+    "calamine": "python_calamine",
+    "openpyxl": "openpyxl",
+}
+DEFAULT_READER = "auto"
+
+
+def available_readers() -> list:
+    return [name for name, module in READERS.items() if importlib.util.find_spec(module)]
+
+
+def reader_name(reader=None) -> str:
+    """
+    The backend to use: `reader`, else the XLSX_READER env var (read per call
+    so .env changes apply), else "auto". Unknown or missing backends fall back
+    to the fastest installed one.
+    """
+    requested = (reader or os.getenv("XLSX_READER", DEFAULT_READER)).strip().lower()
+    available = available_readers()
+    if requested in available:
+        return requested
+    if requested != "auto":
+        print(f"⚠️ XLSX reader '{requested}' not available, using {available[0]}")
+    return available[0]
+
+
+@contextmanager
+def open_workbook(filepath: str, reader=None):
+    """pd.ExcelFile on the selected backend (openpyxl only reads xlsx, so other files let pandas choose)."""
+    engine = reader_name(reader)
+    if engine == "openpyxl" and not zipfile.is_zipfile(filepath):
+        engine = None
+    with pd.ExcelFile(filepath, engine=engine) as xls:
+        yield xls
+
+
+def read_sheet(filepath: str, sheet: str, header=0, reader=None) -> pd.DataFrame:
+    with open_workbook(filepath, reader) as xls:
+        return xls.parse(sheet, header=header)